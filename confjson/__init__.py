@@ -1,89 +1,442 @@
 """A bafflingly simple, JSON-backend configuration manager for python programs."""
-__version__ = "1.3.0"
+# pylint: disable=too-many-lines
+__version__ = "1.4.0"
 
 
+import array
+import collections
+import collections.abc
+import concurrent.futures
 import copy
+import gzip
+import hashlib
+import io
 import json
+import os
 import pathlib
+import re
+import sys
+import tempfile
+import threading
+import urllib.parse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 DEFAULT_CONFIG_FILENAME = "default.config.json"
 USER_CONFIG_FILENAME = "user.config.json"
+MANIFEST_FILENAME = "manifest.json"
+INCLUDE_KEY = "$include"
+INTERN_MAX_LENGTH = 64
+COMPACT_MIN_LENGTH = 8
+PLACEHOLDER_CACHE_SIZE = 1024
+JOURNAL_MAX_RECORDS = 1000
+JOURNAL_MAX_BYTES = 1024 * 1024
+COMPRESSION_SUFFIXES = (".gz", ".zst")
+
+_ABSENT = object()
+_TEMPLATE_PATTERN = re.compile(r"\$(\$?)\{([^{}]*)\}")
+
+# The umask can only be read by setting it, which is not thread-safe, so
+# read it once, on import.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+ChangeSet = collections.namedtuple("ChangeSet", ["added", "removed", "modified"])
+ChangeSet.__doc__ = """Paths, as tuples of keys, of the config items added,
+removed and modified by `Config.reload()`.
+"""
+
+
+class _ConfigDict(dict):
+    """Dict that caches a fingerprint of its contents. Mutations clear
+    the cached fingerprint of the dict and of every enclosing container.
+    """
+
+    __slots__ = ("_parent", "_fingerprint")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._parent = None
+        self._fingerprint = None
+        for key, value in self.items():
+            if type(value) not in _SCALAR_TYPES:
+                dict.__setitem__(self, key, _track(value, self))
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        result = _ConfigDict()
+        memo[id(self)] = result
+        for key, value in self.items():
+            if type(value) not in _SCALAR_TYPES:
+                value = _track(copy.deepcopy(value, memo), result)
+            dict.__setitem__(result, key, value)
+        result._fingerprint = self._fingerprint
+        return result
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._invalidate()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __reduce__(self):
+        # Rebuilt through __init__, so that the slots exist before the
+        # items are added, and without pickling the parent along.
+        return (_ConfigDict, (dict(self),))
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, _track(value, self))
+        self._invalidate()
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    def fingerprint(self):
+        """Return a digest of the contents, computing it if necessary."""
+        if self._fingerprint is None:
+            self._fingerprint = _compute_fingerprint(self)
+        return self._fingerprint
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._invalidate()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._invalidate()
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            super().__setitem__(key, _track(value, self))
+        self._invalidate()
+
+    def _invalidate(self):
+        # pylint: disable=protected-access
+        node = self
+        while node is not None and node._fingerprint is not None:
+            node._fingerprint = None
+            node = node._parent
+
+
+class _ConfigList(list):
+    """List counterpart to _ConfigDict."""
+
+    __slots__ = ("_parent", "_fingerprint")
+
+    def __init__(self, iterable=()):
+        super().__init__(_track(item, self) for item in iterable)
+        self._parent = None
+        self._fingerprint = None
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        result = _ConfigList()
+        memo[id(self)] = result
+        list.extend(
+            result,
+            (
+                item
+                if type(item) in _SCALAR_TYPES
+                else _track(copy.deepcopy(item, memo), result)
+                for item in self
+            ),
+        )
+        result._fingerprint = self._fingerprint
+        return result
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._invalidate()
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, count):
+        super().__imul__(count)
+        self._invalidate()
+        return self
+
+    def __reduce__(self):
+        return (_ConfigList, (list(self),))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [_track(item, self) for item in value]
+        else:
+            value = _track(value, self)
+        super().__setitem__(index, value)
+        self._invalidate()
+
+    def append(self, value):
+        super().append(_track(value, self))
+        self._invalidate()
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    def extend(self, iterable):
+        super().extend(_track(item, self) for item in iterable)
+        self._invalidate()
+
+    def fingerprint(self):
+        """Return a digest of the contents, computing it if necessary."""
+        if self._fingerprint is None:
+            self._fingerprint = _compute_fingerprint(self)
+        return self._fingerprint
+
+    def insert(self, index, value):
+        super().insert(index, _track(value, self))
+        self._invalidate()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._invalidate()
+        return value
+
+    def remove(self, value):
+        super().remove(value)
+        self._invalidate()
+
+    def reverse(self):
+        super().reverse()
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._invalidate()
+
+    _invalidate = _ConfigDict._invalidate  # pylint: disable=protected-access
+
+
+class _CompactList(collections.abc.MutableSequence):
+    """List of numbers of a single type, stored in an array. Falls back
+    to a list once a value of another type is added.
+    """
+
+    __slots__ = ("_items", "_parent", "_fingerprint")
+
+    def __init__(self, typecode, iterable=()):
+        self._items = array.array(typecode, iterable)
+        self._parent = None
+        self._fingerprint = None
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        result = _CompactList.__new__(_CompactList)
+        if isinstance(self._items, array.array):
+            result._items = copy.copy(self._items)
+        else:
+            result._items = copy.deepcopy(self._items, memo)
+            result._items._parent = result
+        result._parent = None
+        result._fingerprint = self._fingerprint
+        memo[id(self)] = result
+        return result
+
+    def __delitem__(self, index):
+        del self._items[index]
+        self._invalidate()
+
+    def __eq__(self, other):
+        if isinstance(other, (list, _CompactList)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._items[index])
+        return self._items[index]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __reduce__(self):
+        if isinstance(self._items, array.array):
+            return (_CompactList, (self._items.typecode, self._items))
+        return (_ConfigList, (list(self._items),))
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            # Iterated more than once below.
+            value = list(value)
+        try:
+            self._items[index] = self._check(value, index)
+        except (TypeError, OverflowError):
+            self._fall_back()
+            self._items[index] = value
+        self._invalidate()
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self._items)
+
+    __hash__ = None
+
+    def clear(self):
+        del self[:]
+
+    def fingerprint(self):
+        """Return a digest of the contents, computing it if necessary."""
+        if self._fingerprint is None:
+            if isinstance(self._items, array.array):
+                self._fingerprint = _compute_fingerprint(self)
+            else:
+                # Goes through the list, so that its fingerprint is cached
+                # and changes below it are passed on to this one.
+                self._fingerprint = self._items.fingerprint()
+        return self._fingerprint
+
+    def insert(self, index, value):
+        try:
+            self._items.insert(index, self._check(value))
+        except (TypeError, OverflowError):
+            self._fall_back()
+            self._items.insert(index, value)
+        self._invalidate()
+
+    def sort(self, *, key=None, reverse=False):
+        """Sort the list in place."""
+        self[:] = sorted(self, key=key, reverse=reverse)
+
+    def _check(self, value, index=0):
+        """Raise TypeError unless `value` can be stored in the array."""
+        # Exact types, since a bool is an int but must not become one.
+        # pylint: disable=unidiomatic-typecheck
+        if isinstance(self._items, array.array):
+            values = value if isinstance(index, slice) else [value]
+            item_type = int if self._items.typecode == "q" else float
+            if any(type(item) is not item_type for item in values):
+                raise TypeError(value)
+            if isinstance(index, slice):
+                value = array.array(self._items.typecode, value)
+        return value
+
+    def _fall_back(self):
+        """Replace the array with a list, which can hold any value."""
+        self._items = _track(_ConfigList(self._items), self)
+
+    _invalidate = _ConfigDict._invalidate  # pylint: disable=protected-access
+
+
+_TRACKED_TYPES = (_ConfigDict, _ConfigList, _CompactList)
+_SCALAR_TYPES = frozenset((str, int, float, bool, type(None)))
 
 
 class _ConfigItemProxy:
     """Proxy object for attribute-style access to config items."""
 
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments
         self,
         dict_,
         use_placeholders=False,
         placeholder_parent=None,
         placeholder_key=None,
+        *,
+        config=None,
+        path=(),
     ):
-        super().__setattr__("_dict", dict_)
-        super().__setattr__("_use_placeholders", use_placeholders)
-        super().__setattr__("_placeholder_parent", placeholder_parent)
-        super().__setattr__("_placeholder_key", placeholder_key)
+        # Written to the instance dict directly, since a proxy is created
+        # for every dict read and super().__setattr__() is slow.
+        attrs = self.__dict__
+        attrs["_dict"] = dict_
+        attrs["_use_placeholders"] = use_placeholders
+        attrs["_config"] = config
+        attrs["_path"] = path
+        attrs["_placeholder_parent"] = placeholder_parent
+        attrs["_placeholder_key"] = placeholder_key
 
     def __bool__(self):
+        self._record_read()
         return bool(self._dict)
 
     def __contains__(self, key):
+        self._record_read()
         return key in self._dict.keys()
 
     def __eq__(self, other):
+        self._record_read()
         if self._dict is None:
             return False
-        if isinstance(other, dict):
-            return self._dict == other
         if isinstance(other, _ConfigItemProxy):
-            return self._dict == other.get_dict()
+            other = other.get_dict()
+        if isinstance(other, dict):
+            return _values_equal(self._dict, other)
         return False
 
     def __getattr__(self, key):
-        if self._dict is None:
-            return _ConfigItemProxy(None, True, self, key)
-        try:
-            value = self._dict[key]
-            if isinstance(value, dict):
-                return _ConfigItemProxy(value, self._use_placeholders)
-            return value
-        except KeyError:
-            if self._use_placeholders:
-                return _ConfigItemProxy(None, True, self, key)
-            raise
+        return self[key]
 
     def __getitem__(self, key):
         if self._dict is None:
-            return _ConfigItemProxy(None, True, self, key)
-        try:
-            value = self._dict[key]
-            if isinstance(value, dict):
-                return _ConfigItemProxy(value, self._use_placeholders)
+            # Everything below a placeholder is missing as well.
+            value = _ABSENT
+        else:
+            value = self._dict.get(key, _ABSENT)
+        config = self._config
+        if isinstance(value, dict):
+            return _ConfigItemProxy(
+                value, self._use_placeholders, config=config, path=self._path + (key,)
+            )
+        if value is not _ABSENT and (
+            # Most reads need no path, which is left unbuilt.
+            config is None
+            or not (config._read_frames or config._interpolate_values)
+        ):
             return value
-        except KeyError:
-            if self._use_placeholders:
-                return _ConfigItemProxy(None, True, self, key)
-            raise
+        path = self._path + (key,)
+        if config is not None:
+            config._record_read(path)
+        if value is _ABSENT:
+            if not self._use_placeholders:
+                raise KeyError(key)
+            if config is None:
+                return _ConfigItemProxy(None, True, self, key, path=path)
+            return config._get_placeholder(self, key, path)
+        return config._interpolate(path, value) if isinstance(value, str) else value
 
     def __setattr__(self, key, value):
-        json.dumps({key: value})
-        if self._dict is None:
-            super().__setattr__("_dict", {})
-            self._placeholder_parent[self._placeholder_key] = self._dict
-            super().__setattr__("_placeholder_parent", None)
-            super().__setattr__("_placeholder_key", None)
-        self._dict[key] = value
+        self[key] = value
 
     def __setitem__(self, key, value):
-        json.dumps({key: value})
+        json.dumps({key: value}, default=_to_json)
         if self._dict is None:
-            super().__setattr__("_dict", {})
+            super().__setattr__("_dict", _ConfigDict())
             self._placeholder_parent[self._placeholder_key] = self._dict
             super().__setattr__("_placeholder_parent", None)
             super().__setattr__("_placeholder_key", None)
         self._dict[key] = value
+        if self._config is not None:
+            self._config._on_change(self._path + (key,))
 
     def get(self, key, default=None):
         """Return the value corresponding to `key` if it exists, else `default`."""
@@ -91,8 +444,18 @@ class _ConfigItemProxy:
             return self[key]
         return default
 
+    def fingerprint(self):
+        """Return a hex digest of the contents, equal for equal contents,
+        or None for a placeholder.
+        """
+        self._record_read()
+        if self._dict is None:
+            return None
+        return _get_fingerprint(self._dict).hex()
+
     def get_dict(self):
         """Return the backing dict."""
+        self._record_read()
         return self._dict
 
     def items(self):
@@ -101,6 +464,7 @@ class _ConfigItemProxy:
 
     def keys(self):
         """Return every key in the ConfigItemProxy."""
+        self._record_read()
         return self._dict.keys()
 
     @property
@@ -108,20 +472,101 @@ class _ConfigItemProxy:
         """Return True if object is a placeholder for a nonexistent dict item."""
         return self._dict is None
 
+    def _record_read(self):
+        if self._config is not None:
+            self._config._record_read(self._path)  # pylint: disable=protected-access
+
+
+class FragmentCache:
+    """Cache of parsed config files, keyed by path, modification time
+    and size. Files with identical contents are parsed only once and
+    share the result. Can be shared between Config objects and threads.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._fragments = {}
+        self._lock = threading.Lock()
+
+    def load(self, path, memory_optimized=False):
+        """Return the parsed contents of the file at `path` and the
+        include paths found in them. The contents must not be modified.
+        """
+        return self._load(path, memory_optimized)[0]
+
+    def clear(self):
+        """Forget every cached file."""
+        with self._lock:
+            self._entries.clear()
+            self._fragments.clear()
+
+    def _load(self, path, memory_optimized):
+        """Like `load()`, but also return how many bytes interning saved
+        when the file was parsed.
+        """
+        stat = path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get((path, memory_optimized))
+        if entry is not None and entry[0] == key:
+            return entry[2]
+
+        data = path.read_bytes()
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        content_key = (digest, memory_optimized)
+        with self._lock:
+            parsed = self._fragments.get(content_key)
+        if parsed is None:
+            if path.suffix in COMPRESSION_SUFFIXES:
+                with _wrap_file(path, io.BytesIO(data), "r") as file:
+                    value, interned_bytes = _parse_json(file.read(), memory_optimized)
+                includes = _find_includes(value)
+            else:
+                value, interned_bytes = _parse_json(data, memory_optimized)
+                # Walking all of the parsed value is slow, and only escapes
+                # could hide an include from a search of the text.
+                if INCLUDE_KEY.encode("utf-8") in data or b"\\u" in data:
+                    includes = _find_includes(value)
+                else:
+                    includes = []
+            parsed = ((value, includes), interned_bytes)
+        with self._lock:
+            parsed = self._fragments.setdefault(content_key, parsed)
+            self._entries[(path, memory_optimized)] = (key, content_key, parsed)
+            if entry is not None and entry[1] != content_key:
+                self._discard_unused(entry[1])
+        return parsed
+
+    def _discard_unused(self, content_key):
+        if all(entry[1] != content_key for entry in self._entries.values()):
+            del self._fragments[content_key]
+
 
 class Config:
     """A manager for JSON-backed default and user-specified config settings."""
 
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments
         self,
         path,
         *,
         user_config_filename=USER_CONFIG_FILENAME,
         default_config_filename=DEFAULT_CONFIG_FILENAME,
         use_placeholders=False,
+        sharded=False,
+        shard_groups=None,
+        journal=False,
+        journal_max_records=JOURNAL_MAX_RECORDS,
+        journal_max_bytes=JOURNAL_MAX_BYTES,
+        fragment_cache=None,
+        interpolate=False,
+        memory_optimized=False,
+        compression_level=None,
     ):
         pathlib_path = pathlib.Path(path)
 
+        if journal and (sharded or shard_groups is not None):
+            raise ValueError("Journal mode cannot be combined with sharded storage.")
+
         if pathlib_path.is_dir():
             super().__setattr__("directory", pathlib_path)
         elif not pathlib_path.exists():
@@ -136,33 +581,94 @@ class Config:
             "default_config_path", self.directory / default_config_filename
         )
         super().__setattr__("user_config_path", self.directory / user_config_filename)
-        super().__setattr__("_default_dict", {})
-        super().__setattr__("_user_dict", {})
+        super().__setattr__("shard_directory", self.user_config_path.with_suffix(".d"))
+        super().__setattr__(
+            "journal_path",
+            self.user_config_path.with_name(self.user_config_path.name + ".journal"),
+        )
+        super().__setattr__("_default_dict", _ConfigDict())
+        super().__setattr__("_user_dict", _ConfigDict())
+        super().__setattr__("_sharded", sharded or shard_groups is not None)
+        super().__setattr__(
+            "_shard_groups",
+            {
+                key: group
+                for group, keys in (shard_groups or {}).items()
+                for key in keys
+            },
+        )
+        super().__setattr__("_shard_index", {})
+        super().__setattr__("_shard_files", {})
+        super().__setattr__("_shard_hashes", {})
+        super().__setattr__("_unloaded_shards", set())
+        super().__setattr__("_saved_fingerprints", {})
+        super().__setattr__("_migrate_user_config", False)
+        super().__setattr__("_journal", journal)
+        super().__setattr__("_journal_max_records", journal_max_records)
+        super().__setattr__("_journal_max_bytes", journal_max_bytes)
+        super().__setattr__("_journal_state", {})
+        super().__setattr__("_journal_records", 0)
+        super().__setattr__("_journal_bytes", 0)
+        super().__setattr__("_compaction_thread", None)
+        super().__setattr__("_fragment_cache", fragment_cache or FragmentCache())
+        super().__setattr__("_interpolate_values", interpolate)
+        super().__setattr__("_memory_optimized", memory_optimized)
+        super().__setattr__("_compression_level", compression_level)
+        super().__setattr__("_template_refs", {})
+        super().__setattr__("_dependents", {})
+        super().__setattr__("_dependents_by_prefix", {})
+        super().__setattr__("_interpolated", {})
+        super().__setattr__("_computed", {})
+        super().__setattr__("_computed_values", {})
+        super().__setattr__("_read_frames", [])
+        super().__setattr__("_placeholders", collections.OrderedDict())
+        super().__setattr__("_placeholder_count", 0)
+        super().__setattr__("_interned_bytes", 0)
         super().__setattr__("_original_attrs", dir(self))
         super().__setattr__("_use_placeholders", use_placeholders)
         self.load()
 
     def __contains__(self, key):
-        return key in self._user_dict or key in self._default_dict
+        self._record_read((key,))
+        return (
+            key in self._user_dict
+            or key in self._default_dict
+            or self._shard_index.get(key) in self._unloaded_shards
+        )
 
     def __delitem__(self, key):
+        self._load_shard_of(key)
+        self._record_saved(key)
         del self._user_dict[key]
+        self._on_change((key,))
 
     def __getattr__(self, key):
         return self[key]
 
     def __getitem__(self, key):
-        try:
-            if key not in self._user_dict:
-                self._user_dict[key] = copy.deepcopy(self._default_dict[key])
-            value = self._user_dict[key]
-            if isinstance(value, dict):
-                return _ConfigItemProxy(value, self._use_placeholders)
-            return value
-        except KeyError:
-            if self._use_placeholders:
-                return _ConfigItemProxy(None, True, self, key)
-            raise
+        path = (key,)
+        if self._unloaded_shards:
+            self._load_shard_of(key)
+        value = self._user_dict.get(key, _ABSENT)
+        if value is _ABSENT:
+            # Checked up front, since raising and catching KeyError is slow.
+            if key not in self._default_dict:
+                self._record_read(path)
+                if self._use_placeholders:
+                    return self._get_placeholder(self, key, path)
+                raise KeyError(key)
+            value = self._get_user_value(key)
+        elif key not in self._saved_fingerprints and type(value) not in _SCALAR_TYPES:
+            self._record_saved(key)
+        if isinstance(value, dict):
+            return _ConfigItemProxy(
+                value, self._use_placeholders, config=self, path=path
+            )
+        if self._read_frames:
+            self._record_read(path)
+        if self._interpolate_values and isinstance(value, str):
+            return self._interpolate(path, value)
+        return value
 
     def __len__(self):
         return len(self.keys())
@@ -177,61 +683,1050 @@ class Config:
 
     def __setitem__(self, key, value):
         # Will fail for values unsupported by JSON.
-        json.dumps({key: value})
+        json.dumps({key: value}, default=_to_json)
+        self._load_shard_of(key)
+        self._record_saved(key)
         self._user_dict[key] = value
+        self._on_change((key,))
+
+    def compact(self):
+        """Fold the journal into the user config file. Only meaningful
+        in journal mode.
+        """
+        if not self._journal:
+            return
+        self._wait_for_compaction()
+        self._rotate_journal()
+        self._wait_for_compaction()
+
+    def computed(self, name, function=None):
+        """Register `function` as the computed setting `name`. It is called
+        with the config as its only argument the first time the setting
+        is read through `get_computed()`, and again only after a setting
+        it read has changed through a setter, `load()` or `reload()`.
+        Can also be used as a decorator.
+        """
+        if function is None:
+            return lambda function: self.computed(name, function)
+        self._computed[name] = function
+        self._computed_values.pop(name, None)
+        return function
 
     def default_keys(self):
         """Get only the keys present in the default config."""
         return self._default_dict.keys()
 
+    def diff(self, path=None):
+        """Get a copy of the user config settings that differ from their
+        default values, as `save()` would write them, or only those at
+        `path`, a dotted string or a sequence of keys. Raise KeyError if
+        nothing at `path` differs.
+        """
+        for shard in list(self._unloaded_shards):
+            self._load_shard(shard)
+        diff = _get_dict_diff(self._user_dict, self._default_dict)
+        for key in () if path is None else _split_path(path):
+            if not isinstance(diff, dict) or key not in diff:
+                raise KeyError(key)
+            diff = diff[key]
+        return copy.deepcopy(diff)
+
     def get(self, key, default=None):
         """Get the value of the given key from the user config, the
         default config or the optional `default` argument, in order of
         preference.
         """
-        try:
-            return self[key]
-        except KeyError:
+        if not self._use_placeholders and key not in self:
             return default
+        return self[key]
 
     def get_default(self, key):
-        """Get the default value of the given setting, even if there is
-        a user setting.
+        """Get a copy of the default value of the given setting, even if
+        there is a user setting.
+        """
+        # The defaults may be shared with other configs that load the same
+        # default config file.
+        return copy.deepcopy(self._default_dict[key])
+
+    def get_computed(self, name):
+        """Get the value of the computed setting `name`."""
+        if name in self._computed_values:
+            value, paths = self._computed_values[name]
+        else:
+            function = self._computed[name]
+            if any(frame[0] == name for frame in self._read_frames):
+                raise ValueError(f"Computed setting '{name}' depends on itself.")
+            self._read_frames.append((name, set()))
+            try:
+                value = function(self)
+            finally:
+                _, paths = self._read_frames.pop()
+            self._computed_values[name] = (value, paths)
+        if self._read_frames:
+            self._read_frames[-1][1].update(paths)
+        return value
+
+    def memory_stats(self):
+        """Report how the loaded config shares string objects and stores
+        numeric lists as arrays; see the `memory_optimized` argument.
+        `interned_string_bytes_saved` is the size of the parsed strings
+        that interning replaced with an existing equal string.
+        `shared_string_bytes` is the size of every repeated reference to
+        the same string object, including sharing that happens without
+        interning, such as keys repeated within one file.
+        `compact_list_bytes_saved` estimates what arrays save over lists.
+        """
+        stats = {
+            "strings": 0,
+            "unique_strings": 0,
+            "shared_string_bytes": 0,
+            "interned_string_bytes_saved": self._interned_bytes,
+            "compact_lists": 0,
+            "compact_items": 0,
+            "compact_list_bytes_saved": 0,
+        }
+        seen_strings = set()
+        for dict_ in (self._default_dict, self._user_dict):
+            _add_memory_stats(dict_, stats, seen_strings, set())
+        return stats
+
+    def _add_interned_bytes(self, interned_bytes):
+        super().__setattr__("_interned_bytes", self._interned_bytes + interned_bytes)
+
+    def get_path(self, path):
+        """Get the raw value at `path`, either a dotted string such as
+        "database.host" or a sequence of keys, without copying defaults
+        or creating config item proxies. The value must not be modified;
+        use `set_path()` instead.
         """
-        return self._default_dict[key]
+        self._record_read(tuple(_split_path(path)))
+        key, *keys = _split_path(path)
+        self._load_shard_of(key)
+        if key in self._user_dict:
+            value = self._user_dict[key]
+        else:
+            value = self._default_dict[key]
+        for key in keys:
+            if not isinstance(value, dict):
+                raise KeyError(key)
+            value = value[key]
+        return value
 
     def keys(self):
         """Get the keys present in the config."""
-        return list(set(self._user_dict.keys()).union(self._default_dict.keys()))
+        self._record_read(())
+        return list(
+            set(self._user_dict.keys()).union(
+                self._default_dict.keys(),
+                (
+                    key
+                    for key, shard in self._shard_index.items()
+                    if shard in self._unloaded_shards
+                ),
+            )
+        )
 
     def load(self):
         """Load or reload config settings from the backing JSON files.
         Note that this will reset any unsaved user config settings.
         """
-        try:
-            with self.default_config_path.open() as file:
-                super().__setattr__("_default_dict", json.load(file))
-        except FileNotFoundError:
-            super().__setattr__("_default_dict", {})
+        # A compaction running in the background may be about to replace
+        # the user config file and remove the journal it was folded from.
+        self._wait_for_compaction()
+        dependencies = self._get_computed_dependencies()
+        self._placeholders.clear()
+        super().__setattr__("_placeholder_count", 0)
+        super().__setattr__("_default_dict", self._load_default_config())
+        if self._sharded and self._load_manifest():
+            super().__setattr__("_user_dict", _ConfigDict())
+        else:
+            self._load_user_config()
+        super().__setattr__("_saved_fingerprints", {})
+        self._build_template_graph()
+        self._invalidate_computed(
+            path
+            for path, value in dependencies.items()
+            if not _values_equal(value, self._get_path_or_absent(path))
+        )
+
+    def _load_user_config(self):
+        user_dict = self._read_user_config()
+        super().__setattr__(
+            "_user_dict",
+            _get_dict_union(user_dict, self._default_dict)
+            if user_dict
+            else _ConfigDict(),
+        )
+
+        if self._sharded:
+            # No manifest yet; move the monolithic user config into shards
+            # on the next save.
+            super().__setattr__("_migrate_user_config", bool(self._user_dict))
 
+    def _read_user_config(self):
+        """Parse the user config file and apply the journal, if any."""
         try:
-            with self.user_config_path.open() as file:
-                super().__setattr__(
-                    "_user_dict", _get_dict_union(json.load(file), self._default_dict)
+            with self.user_config_path.open(mode="rb") as raw_file, _wrap_file(
+                self.user_config_path, raw_file, "r"
+            ) as file:
+                user_dict, interned_bytes = _parse_json(
+                    file.read(), self._memory_optimized
                 )
+            self._add_interned_bytes(interned_bytes)
         except FileNotFoundError:
-            super().__setattr__("_user_dict", {})
+            user_dict = {}
+
+        if self._journal:
+            user_dict = self._replay_journal(user_dict)
+        return user_dict
+
+    def reload(self):
+        """Like `load()`, but update the loaded config in place, keeping
+        the identity of every dict whose contents did not change, so that
+        config items already handed out stay live. Return a ChangeSet of
+        the paths whose values changed. Shards not loaded yet are left
+        unloaded, and their settings are not compared.
+        """
+        self._wait_for_compaction()
+        self._placeholders.clear()
+        super().__setattr__("_placeholder_count", 0)
+        user_dict = self._user_dict
+        old_default_dict = self._default_dict
+        loaded_shards = set(self._shard_files) - self._unloaded_shards
+        super().__setattr__("_default_dict", self._load_default_config())
+        new_default_dict = self._default_dict
+        new_user_dict = self._read_user_overlay(loaded_shards)
+
+        changes = ChangeSet([], [], [])
+        keys = list(user_dict)
+        for dict_ in (new_user_dict, old_default_dict, new_default_dict):
+            keys.extend(key for key in dict_ if key not in user_dict)
+        for key in dict.fromkeys(keys):
+            if self._shard_index.get(key) in self._unloaded_shards:
+                continue
+            old_value = user_dict.get(key, old_default_dict.get(key, _ABSENT))
+            new_value = new_user_dict.get(key, new_default_dict.get(key, _ABSENT))
+            if key in user_dict:
+                _reconcile(
+                    user_dict, key, old_value, new_value, (key,), changes=changes
+                )
+            else:
+                # Nothing refers to values that were never copied from the
+                # defaults, so there is nothing to keep.
+                _reconcile(None, key, old_value, new_value, (key,), changes=changes)
+                if key in new_user_dict:
+                    user_dict[key] = new_value
+
+        # Settings handed out before are still live, so they stay recorded.
+        saved_keys = list(self._saved_fingerprints)
+        super().__setattr__("_saved_fingerprints", {})
+        self._mark_saved(saved_keys)
+        self._build_template_graph()
+        self._invalidate_computed(changes.added + changes.removed + changes.modified)
+        return changes
+
+    def _read_user_overlay(self, loaded_shards):
+        """Read the user config, or those of `loaded_shards` that are still
+        in the reread manifest plus any shard with a loaded setting, and
+        return it over the defaults as `_get_dict_overlay()` does, without
+        copying anything.
+        """
+        if self._sharded and self._load_manifest():
+            user_dict = {}
+            loaded_shards.update(
+                shard
+                for key, shard in self._shard_index.items()
+                if key in self._user_dict
+            )
+            for shard in loaded_shards & set(self._shard_files):
+                shard_dict = self._read_shard(shard)
+                user_dict.update(
+                    _get_dict_overlay(
+                        shard_dict,
+                        {
+                            key: self._default_dict[key]
+                            for key in shard_dict
+                            if key in self._default_dict
+                        },
+                    )
+                )
+            return user_dict
+
+        user_dict = self._read_user_config()
+        if self._sharded:
+            super().__setattr__("_migrate_user_config", bool(user_dict))
+        if not user_dict:
+            return {}
+        return _get_dict_overlay(user_dict, self._default_dict)
 
     def save(self):
         """Save any user config settings that differ from their
         respective default values.
         """
-        diff = _get_dict_diff(self._user_dict, self._default_dict)
-        if diff:
-            with self.user_config_path.open(mode="w") as file:
-                json.dump(diff, file, indent=4, sort_keys=True)
+        modified_keys = self._get_modified_keys()
+        if self._sharded:
+            self._save_shards(modified_keys)
+        elif self._journal:
+            self._save_journal(modified_keys)
+        else:
+            diff = _get_dict_diff(self._user_dict, self._default_dict)
+            if diff:
+                with self.user_config_path.open(mode="wb") as raw_file, _wrap_file(
+                    self.user_config_path, raw_file, "w", self._compression_level
+                ) as file:
+                    json.dump(diff, file, indent=4, sort_keys=True, default=_to_json)
+            elif self.user_config_path.exists():
+                self.user_config_path.unlink()
+        self._mark_saved(modified_keys)
+
+    def is_modified(self):
+        """Return True if the config has changes that `save()` has yet
+        to write.
+        """
+        return bool(self._get_modified_keys())
+
+    def _get_fingerprint_of(self, key):
+        """Fingerprint the current value of the top-level setting `key`,
+        or return None if there is none.
+        """
+        if key in self._user_dict:
+            return _get_fingerprint(self._user_dict[key])
+        if key in self._default_dict:
+            return _get_fingerprint(self._default_dict[key])
+        return None
+
+    def _get_modified_keys(self):
+        """Get the top-level keys whose values changed since they were
+        last loaded or saved. Only settings handed out or set since can
+        have changed, and cached fingerprints make this cheap for those
+        that did not.
+        """
+        modified_keys = {
+            key
+            for key, saved_fingerprint in self._saved_fingerprints.items()
+            if self._get_fingerprint_of(key) != saved_fingerprint
+        }
+        if self._migrate_user_config:
+            # Nothing has been written to shards yet.
+            modified_keys.update(self._user_dict)
+        return modified_keys
+
+    def _record_saved(self, key):
+        """Record the fingerprint of the top-level setting `key` as last
+        loaded or saved, unless that is done already. Called before the
+        setting is first handed out or set, so that nothing needs to be
+        fingerprinted on load.
+        """
+        if key not in self._saved_fingerprints:
+            self._saved_fingerprints[key] = self._get_fingerprint_of(key)
+
+    def _mark_saved(self, keys):
+        """Record the current values of `keys` as the saved ones."""
+        for key in keys:
+            if key in self._user_dict:
+                self._saved_fingerprints[key] = _get_fingerprint(self._user_dict[key])
+            else:
+                self._saved_fingerprints.pop(key, None)
+
+    def _load_default_config(self):
+        """Load the default config, splicing in any included files. Each
+        round of newly discovered includes is parsed in parallel.
+        """
+        # pylint: disable=protected-access
+        super().__setattr__("_interned_bytes", 0)
+        try:
+            default_config_path = _find_config_file(self.default_config_path)
+            (value, includes), interned_bytes = self._fragment_cache._load(
+                default_config_path, self._memory_optimized
+            )
+        except FileNotFoundError:
+            return _ConfigDict()
+        super().__setattr__("_interned_bytes", interned_bytes)
+        if not includes:
+            # Cached fragments are never modified, so there is no need to copy.
+            return value
+
+        fragments = {default_config_path: (value, includes)}
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            while includes:
+                paths = [
+                    path
+                    for path in self._resolve_includes(includes)
+                    if path not in fragments
+                ]
+                for path, (fragment, interned_bytes) in zip(
+                    paths,
+                    executor.map(
+                        self._fragment_cache._load,
+                        paths,
+                        [self._memory_optimized] * len(paths),
+                    ),
+                ):
+                    fragments[path] = fragment
+                    self._add_interned_bytes(interned_bytes)
+                includes = [include for path in paths for include in fragments[path][1]]
+        return self._expand_includes(value, fragments, (default_config_path,))
+
+    def _resolve_includes(self, includes):
+        return list(dict.fromkeys(self.directory / include for include in includes))
+
+    def _expand_includes(self, value, fragments, stack):
+        """Return a copy of `value` with included files spliced in."""
+        if isinstance(value, dict):
+            if INCLUDE_KEY in value:
+                return self._expand_include(value, fragments, stack)
+            return _ConfigDict(
+                (key, self._expand_includes(item, fragments, stack))
+                for key, item in value.items()
+            )
+        if isinstance(value, list):
+            return _ConfigList(
+                self._expand_includes(item, fragments, stack) for item in value
+            )
+        return value
+
+    def _expand_include(self, value, fragments, stack):
+        includes = value[INCLUDE_KEY]
+        if isinstance(includes, str):
+            includes = [includes]
+        result = _ConfigDict()
+        for path in self._resolve_includes(includes):
+            if path in stack:
+                raise ValueError(
+                    "Circular include: "
+                    + " -> ".join(str(item) for item in stack + (path,))
+                )
+            included_value, included_includes = fragments[path]
+            if included_includes:
+                included_value = self._expand_includes(
+                    included_value, fragments, stack + (path,)
+                )
+            else:
+                included_value = _copy(included_value)
+            if len(value) == 1 and len(includes) == 1:
+                return included_value
+            if not isinstance(included_value, dict):
+                raise ValueError(
+                    f"Cannot merge '{path}' into a dict; it does not contain one."
+                )
+            result.update(included_value)
+        for key, item in value.items():
+            if key != INCLUDE_KEY:
+                result[key] = self._expand_includes(item, fragments, stack)
+        return result
+
+    @property
+    def _old_journal_path(self):
+        return self.journal_path.with_name(self.journal_path.name + ".1")
+
+    def _replay_journal(self, user_dict):
+        """Apply the journal, including any journal left over from an
+        interrupted compaction, on top of the user config file.
+        """
+        _read_journal(self._old_journal_path, user_dict)
+        records, size = _read_journal(self.journal_path, user_dict, truncate=True)
+        super().__setattr__("_journal_state", copy.deepcopy(user_dict))
+        super().__setattr__("_journal_records", records)
+        super().__setattr__("_journal_bytes", size)
+        return user_dict
+
+    def _save_journal(self, modified_keys):
+        changes = []
+        for key in modified_keys:
+            if key in self._user_dict:
+                diff = _get_dict_diff({key: self._user_dict[key]}, self._default_dict)
+            else:
+                diff = {}
+            change_count = len(changes)
+            _get_path_changes(
+                (key,),
+                self._journal_state.get(key, _ABSENT),
+                diff.get(key, _ABSENT),
+                changes,
+            )
+            if len(changes) == change_count:
+                continue
+            if key in diff:
+                self._journal_state[key] = copy.deepcopy(diff[key])
+            else:
+                del self._journal_state[key]
+
+        if not changes:
+            return
+        text = "".join(
+            json.dumps(change, separators=(",", ":"), default=_to_json) + "\n"
+            for change in changes
+        )
+        with self.journal_path.open(mode="a") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        super().__setattr__("_journal_records", self._journal_records + len(changes))
+        super().__setattr__("_journal_bytes", self._journal_bytes + len(text))
+
+        compaction_running = (
+            self._compaction_thread is not None and self._compaction_thread.is_alive()
+        )
+        if not compaction_running and (
+            self._journal_records >= self._journal_max_records
+            or self._journal_bytes >= self._journal_max_bytes
+        ):
+            self._rotate_journal()
+
+    def _rotate_journal(self):
+        """Set the current journal aside and fold it into the user config
+        file on a background thread. New records go to a fresh journal
+        in the meantime.
+        """
+        snapshot = copy.deepcopy(self._journal_state)
+        # A journal left over from an interrupted compaction is already
+        # part of the snapshot, but must not be replaced until the user
+        # config file includes it.
+        if self.journal_path.exists() and not self._old_journal_path.exists():
+            os.replace(str(self.journal_path), str(self._old_journal_path))
+            super().__setattr__("_journal_records", 0)
+            super().__setattr__("_journal_bytes", 0)
+        thread = threading.Thread(
+            target=self._fold_journal, args=(snapshot,), daemon=True
+        )
+        super().__setattr__("_compaction_thread", thread)
+        thread.start()
+
+    def _fold_journal(self, snapshot):
+        if snapshot:
+            _write_atomically(
+                self.user_config_path,
+                json.dumps(snapshot, indent=4, sort_keys=True, default=_to_json),
+                self._compression_level,
+            )
         elif self.user_config_path.exists():
             self.user_config_path.unlink()
+        if self._old_journal_path.exists():
+            self._old_journal_path.unlink()
+
+    def _wait_for_compaction(self):
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+            super().__setattr__("_compaction_thread", None)
+
+    def set_path(self, path, value):
+        """Set the value at `path`, either a dotted string such as
+        "database.host" or a sequence of keys, creating any missing
+        dicts along the way.
+        """
+        *keys, last_key = _split_path(path)
+        json.dumps({last_key: value}, default=_to_json)
+        if not keys:
+            self[last_key] = value
+            return
+        key, *keys = keys
+        if key not in self:
+            self[key] = {}
+        dict_ = self._get_user_value(key)
+        for key in keys:
+            if not isinstance(dict_, dict):
+                break
+            dict_ = dict_.setdefault(key, {})
+        if not isinstance(dict_, dict):
+            raise TypeError(
+                f"Cannot set '{last_key}' in '{path}'; its parent is not a dict."
+            )
+        dict_[last_key] = value
+        self._on_change(tuple(_split_path(path)))
+
+    def _on_change(self, path):
+        """Update derived state after the value at `path` was set or
+        deleted.
+        """
+        if self._placeholders:
+            self._drop_placeholders(path[0])
+        changed_paths = [path]
+        if self._interpolate_values:
+            changed_paths.extend(self._update_template_graph(path))
+        if self._computed_values:
+            self._invalidate_computed(changed_paths)
+
+    def _get_placeholder(self, parent, key, path):
+        """Return a placeholder for the missing item `key` of `parent`,
+        the config or a config item proxy, at `path`. Placeholders are
+        cached until a setting under the same top-level key changes, so
+        that probing a missing path again allocates no placeholder. Up to
+        `PLACEHOLDER_CACHE_SIZE` of them are kept, grouped by top-level key
+        and dropped a group at a time, least recently used first.
+        """
+        # pylint: disable=protected-access
+        placeholders = self._placeholders.get(path[0])
+        if placeholders is None:
+            placeholders = self._placeholders[path[0]] = {}
+        else:
+            self._placeholders.move_to_end(path[0])
+        placeholder = placeholders.get(path)
+        if placeholder is None:
+            super().__setattr__("_placeholder_count", self._placeholder_count + 1)
+        elif placeholder._dict is None and (
+            # Proxies for dicts are created on every read, so compare the
+            # dicts, which may have been replaced without going through a
+            # setter; a placeholder parent must be the same one.
+            placeholder._placeholder_parent is parent
+            or parent._dict is not None
+            and placeholder._placeholder_parent._dict is parent._dict
+        ):
+            return placeholder
+        placeholder = _ConfigItemProxy(None, True, parent, key, config=self, path=path)
+        placeholders[path] = placeholder
+        while self._placeholder_count > PLACEHOLDER_CACHE_SIZE:
+            self._drop_placeholders(next(iter(self._placeholders)))
+        return placeholder
+
+    def _drop_placeholders(self, key):
+        placeholders = self._placeholders.pop(key, None)
+        if placeholders:
+            super().__setattr__(
+                "_placeholder_count", self._placeholder_count - len(placeholders)
+            )
+
+    def _record_read(self, path):
+        """Add `path` to the dependencies of the computed setting being
+        evaluated, if any.
+        """
+        if self._read_frames:
+            self._read_frames[-1][1].add(path)
+
+    def _get_path_or_absent(self, path):
+        if not path:
+            return frozenset(self.keys())
+        try:
+            return self.get_path(path)
+        except KeyError:
+            return _ABSENT
+
+    def _get_computed_dependencies(self):
+        """Get the current value of every path that a cached computed
+        setting depends on.
+        """
+        return {
+            path: self._get_path_or_absent(path)
+            for _, paths in self._computed_values.values()
+            for path in paths
+        }
+
+    def _invalidate_computed(self, changed_paths):
+        changed_paths = list(changed_paths)
+        if not changed_paths:
+            return
+        for name, (_, paths) in list(self._computed_values.items()):
+            if any(
+                _paths_overlap(path, changed_path)
+                for path in paths
+                for changed_path in changed_paths
+            ):
+                del self._computed_values[name]
+
+    def _build_template_graph(self):
+        for name in ("_template_refs", "_dependents", "_dependents_by_prefix"):
+            super().__setattr__(name, {})
+        super().__setattr__("_interpolated", {})
+        if self._interpolate_values:
+            for key in self.keys():
+                self._add_templates((key,), self.get_path([key]))
+
+    def _add_templates(self, path, value):
+        """Add every template string in `value` to the dependency graph."""
+        if isinstance(value, dict):
+            for key, item in value.items():
+                self._add_templates(path + (key,), item)
+        elif isinstance(value, str) and "${" in value:
+            refs = [
+                tuple(_split_path(match.group(2)))
+                for match in _TEMPLATE_PATTERN.finditer(value)
+                if not match.group(1)
+            ]
+            self._template_refs[path] = refs
+            for ref in refs:
+                self._dependents.setdefault(ref, set()).add(path)
+                for index in range(1, len(ref) + 1):
+                    self._dependents_by_prefix.setdefault(ref[:index], set()).add(path)
+
+    def _remove_templates(self, path):
+        """Remove every template at or below `path` from the dependency
+        graph, returning their paths.
+        """
+        removed = [
+            template_path
+            for template_path in self._template_refs
+            if template_path[: len(path)] == path
+        ]
+        for template_path in removed:
+            for ref in self._template_refs.pop(template_path):
+                self._dependents[ref].discard(template_path)
+                for index in range(1, len(ref) + 1):
+                    self._dependents_by_prefix[ref[:index]].discard(template_path)
+        return removed
+
+    def _update_template_graph(self, path):
+        changed_paths = self._remove_templates(path)
+        try:
+            value = self.get_path(path)
+        except KeyError:
+            pass
+        else:
+            self._add_templates(path, value)
+        changed_paths.append(path)
+
+        # Forget the resolved values of the templates that changed and of
+        # every template that depends on them, directly or indirectly.
+        visited = set(changed_paths)
+        while changed_paths:
+            path = changed_paths.pop()
+            self._interpolated.pop(path, None)
+            dependents = set(self._dependents_by_prefix.get(path, ()))
+            for index in range(1, len(path)):
+                dependents.update(self._dependents.get(path[:index], ()))
+            dependents -= visited
+            visited.update(dependents)
+            changed_paths.extend(dependents)
+        return visited
+
+    def _record_template_refs(self, path, visited):
+        """Record the paths that the template at `path` refers to,
+        directly or indirectly, as read.
+        """
+        for ref in self._template_refs.get(path, ()):
+            if ref not in visited:
+                visited.add(ref)
+                self._record_read(ref)
+                self._record_template_refs(ref, visited)
+
+    def _interpolate(self, path, value, stack=()):
+        """Return the string `value` found at `path` with every "${path}"
+        reference replaced by the value it refers to. A string that is a
+        single reference is replaced by the value itself, which may be of
+        any type; a dict or list is handed out as reading it directly
+        would. "$${" is a literal "${".
+        """
+        if not self._interpolate_values or "${" not in value:
+            return value
+        if self._read_frames:
+            self._record_template_refs(path, set())
+        memo = self._interpolated.get(path)
+        if memo is not None and memo[0] is value:
+            return memo[1]
+        if path in stack:
+            raise ValueError(
+                "Circular reference: "
+                + " -> ".join(".".join(item) for item in stack + (path,))
+            )
+
+        def _resolve(ref):
+            ref_path = tuple(_split_path(ref))
+            try:
+                ref_value = self.get_path(ref_path)
+            except KeyError:
+                raise ValueError(
+                    f"'{'.'.join(path)}' refers to '{ref}', which does not exist."
+                ) from None
+            if isinstance(ref_value, str):
+                return self._interpolate(ref_path, ref_value, stack + (path,))
+            return ref_value
+
+        match = _TEMPLATE_PATTERN.fullmatch(value)
+        if match and not match.group(1):
+            result = _resolve(match.group(2))
+            if isinstance(result, (dict, list, _CompactList, _ConfigItemProxy)):
+                # Not memoized, since it is the live config item itself.
+                return self._get_item(_split_path(match.group(2)))
+        else:
+            result = _TEMPLATE_PATTERN.sub(
+                lambda match: "${" + match.group(2) + "}"
+                if match.group(1)
+                else _to_string(_resolve(match.group(2))),
+                value,
+            )
+        self._interpolated[path] = (value, result)
+        return result
+
+    def _get_item(self, path):
+        """Get the config item at `path` the way `__getitem__()` would."""
+        item = self
+        for key in path:
+            item = item[key]
+        return item
+
+    def _get_user_value(self, key):
+        """Get the value of the given key from the user config, copying
+        it from the default config first if necessary.
+        """
+        self._load_shard_of(key)
+        if key not in self._user_dict:
+            self._user_dict[key] = _copy(self._default_dict[key])
+        # After copying, so that the fingerprint is cached on the copy.
+        self._record_saved(key)
+        return self._user_dict[key]
+
+    def _load_manifest(self):
+        """Read the shard manifest, leaving every shard unloaded.
+        Return False if there is no manifest.
+        """
+        try:
+            with (self.shard_directory / MANIFEST_FILENAME).open() as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            manifest = {"shards": {}}
+            found = False
+        else:
+            found = True
+
+        super().__setattr__("_migrate_user_config", False)
+        super().__setattr__("_shard_hashes", {})
+        super().__setattr__(
+            "_shard_files",
+            {shard: entry["file"] for shard, entry in manifest["shards"].items()},
+        )
+        super().__setattr__(
+            "_shard_index",
+            {
+                key: shard
+                for shard, entry in manifest["shards"].items()
+                for key in entry["keys"]
+            },
+        )
+        super().__setattr__("_unloaded_shards", set(self._shard_files))
+        return found
+
+    def _load_shard_of(self, key):
+        shard = self._shard_index.get(key)
+        if shard in self._unloaded_shards:
+            self._load_shard(shard)
+
+    def _load_shard(self, shard):
+        shard_dict = self._read_shard(shard)
+        self._user_dict.update(
+            _get_dict_union(
+                shard_dict,
+                {
+                    key: self._default_dict[key]
+                    for key in shard_dict
+                    if key in self._default_dict
+                },
+            )
+        )
+
+    def _read_shard(self, shard):
+        """Parse the file of `shard` and mark the shard loaded."""
+        self._unloaded_shards.discard(shard)
+        try:
+            with (self.shard_directory / self._shard_files[shard]).open() as file:
+                text = file.read()
+        except FileNotFoundError:
+            return {}
+        self._shard_hashes[shard] = _get_text_hash(text)
+        shard_dict, interned_bytes = _parse_json(text, self._memory_optimized)
+        self._add_interned_bytes(interned_bytes)
+        return shard_dict
+
+    def _save_shards(self, modified_keys):
+        for key in modified_keys:
+            if key not in self._shard_index:
+                self._shard_index[key] = self._shard_groups.get(key, key)
+        dirty_shards = {self._shard_index[key] for key in modified_keys}
+        for shard in dirty_shards & self._unloaded_shards:
+            self._load_shard(shard)
+
+        shard_dicts = {shard: {} for shard in dirty_shards}
+        previous_keys = {shard: set() for shard in dirty_shards}
+        for key, shard in list(self._shard_index.items()):
+            if shard in shard_dicts:
+                # Keys are re-added below if they still differ from the defaults.
+                del self._shard_index[key]
+                previous_keys[shard].add(key)
+                if key in self._user_dict:
+                    shard_dicts[shard][key] = self._user_dict[key]
+
+        manifest_changed = self._migrate_user_config
+        previous_files = set(self._shard_files.values())
+        self.shard_directory.mkdir(parents=True, exist_ok=True)
+        for shard, shard_dict in shard_dicts.items():
+            if self._save_shard(shard, shard_dict, previous_keys[shard]):
+                manifest_changed = True
+        if manifest_changed:
+            self._save_manifest()
+
+        # Only remove stale files once the manifest no longer refers to them.
+        for filename in previous_files.difference(self._shard_files.values()):
+            (self.shard_directory / filename).unlink()
+        if self._migrate_user_config:
+            if self.user_config_path.exists():
+                self.user_config_path.unlink()
+            super().__setattr__("_migrate_user_config", False)
+
+    def _save_shard(self, shard, shard_dict, previous_keys):
+        """Write the settings in `shard_dict` that differ from the
+        defaults to the file of `shard`, unless it holds them already, or
+        drop the file if there are none. Return True if the manifest needs
+        to be rewritten.
+        """
+        diff = _get_dict_diff(shard_dict, self._default_dict)
+        for key in diff:
+            self._shard_index[key] = shard
+        manifest_changed = set(diff) != previous_keys
+
+        if not diff:
+            if shard in self._shard_files:
+                del self._shard_files[shard]
+                self._shard_hashes.pop(shard, None)
+                manifest_changed = True
+            return manifest_changed
+
+        if shard not in self._shard_files:
+            self._shard_files[shard] = _get_shard_filename(shard)
+            manifest_changed = True
+        text = json.dumps(diff, indent=4, sort_keys=True, default=_to_json)
+        text_hash = _get_text_hash(text)
+        if self._shard_hashes.get(shard) != text_hash:
+            _write_atomically(self.shard_directory / self._shard_files[shard], text)
+            self._shard_hashes[shard] = text_hash
+        return manifest_changed
+
+    def _save_manifest(self):
+        shards = {
+            shard: {"file": filename, "keys": []}
+            for shard, filename in self._shard_files.items()
+        }
+        for key, shard in self._shard_index.items():
+            shards[shard]["keys"].append(key)
+        for entry in shards.values():
+            entry["keys"].sort()
+        _write_atomically(
+            self.shard_directory / MANIFEST_FILENAME,
+            json.dumps({"version": 1, "shards": shards}, indent=4, sort_keys=True),
+        )
+
+
+class ConfigSet(collections.abc.Mapping):
+    """A collection of Configs, one for each subdirectory of `path`, keyed
+    by directory name and loaded on first access. At most `max_loaded`
+    configs are kept in memory, dropping the least recently used configs
+    without unsaved changes first. Other keyword arguments are passed on
+    to every Config; a shared FragmentCache means that identical default
+    config files are parsed only once.
+    """
+
+    def __init__(self, path, *, max_loaded=None, max_workers=None, **config_kwargs):
+        directory = pathlib.Path(path)
+        if not directory.is_dir():
+            raise ValueError(
+                "Parameter `path` must be the path of an existing directory;"
+                f" '{path}' is not a directory."
+            )
+        self.directory = directory
+        config_kwargs.setdefault("fragment_cache", FragmentCache())
+        self._config_kwargs = config_kwargs
+        self._max_loaded = max_loaded
+        self._max_workers = max_workers
+        self._configs = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._names = {}
+        self.rescan()
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+        with self._lock:
+            config = self._configs.get(name)
+            if config is not None:
+                self._configs.move_to_end(name)
+                return config
+        # Loading a config can take a while, so it is done without holding
+        # the lock; should another thread get there first, its config wins.
+        config = self._create_config(name)
+        with self._lock:
+            config = self._configs.setdefault(name, config)
+            self._configs.move_to_end(name)
+            self._evict()
+            return config
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def load(self, names=None):
+        """Load the named configs, or all of them, on a pool of up to
+        `max_workers` threads. Only the first `max_loaded` configs not
+        yet in memory are loaded.
+        """
+        with self._lock:
+            names = [
+                name
+                for name in (self._names if names is None else names)
+                if name not in self._configs
+            ]
+            for name in names:
+                if name not in self._names:
+                    raise KeyError(name)
+            names = names[: self._max_loaded]
+        with concurrent.futures.ThreadPoolExecutor(self._max_workers) as executor:
+            configs = list(executor.map(self._create_config, names))
+        with self._lock:
+            for name, config in zip(names, configs):
+                self._configs.setdefault(name, config)
+            self._evict()
+
+    def loaded(self):
+        """Get the names of the configs currently in memory, from least
+        to most recently used.
+        """
+        with self._lock:
+            return list(self._configs)
+
+    def rescan(self):
+        """Look for config directories added or removed since the
+        ConfigSet was created. Configs whose directory is gone are dropped,
+        even if they have unsaved changes.
+        """
+        with os.scandir(self.directory) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_dir())
+        with self._lock:
+            self._names = dict.fromkeys(names)
+            for name in list(self._configs):
+                if name not in self._names:
+                    del self._configs[name]
+
+    def save_all(self):
+        """Save every loaded config with unsaved changes, in parallel.
+        Return the names of the configs saved.
+        """
+        with self._lock:
+            modified = [
+                (name, config)
+                for name, config in self._configs.items()
+                if config.is_modified()
+            ]
+        with concurrent.futures.ThreadPoolExecutor(self._max_workers) as executor:
+            list(executor.map(lambda item: item[1].save(), modified))
+        with self._lock:
+            self._evict()
+        return [name for name, _ in modified]
+
+    def _create_config(self, name):
+        return Config(self.directory / name, **self._config_kwargs)
+
+    def _evict(self):
+        if self._max_loaded is None:
+            return
+        excess = len(self._configs) - self._max_loaded
+        # Never drop the most recently used config, which the caller may
+        # be about to modify.
+        for name in list(self._configs)[:-1]:
+            if excess <= 0:
+                break
+            if not self._configs[name].is_modified():
+                del self._configs[name]
+                excess -= 1
 
 
 def _get_dict_diff(top_dict, bottom_dict):
@@ -239,7 +1734,7 @@ def _get_dict_diff(top_dict, bottom_dict):
     for key, top_value in top_dict.items():
         if key in bottom_dict:
             bottom_value = bottom_dict[key]
-            if top_value != bottom_value:
+            if not _values_equal(top_value, bottom_value):
                 if isinstance(top_value, dict) and isinstance(bottom_value, dict):
                     result_dict[key] = _get_dict_diff(top_value, bottom_value)
                 else:
@@ -250,7 +1745,7 @@ def _get_dict_diff(top_dict, bottom_dict):
 
 
 def _get_dict_union(top_dict, bottom_dict):
-    result_dict = {}
+    result_dict = _ConfigDict()
     for key in set(top_dict.keys()).union(bottom_dict.keys()):
         if key in top_dict:
             top_value = top_dict[key]
@@ -261,7 +1756,413 @@ def _get_dict_union(top_dict, bottom_dict):
             ):
                 result_dict[key] = _get_dict_union(top_value, bottom_dict[key])
             else:
-                result_dict[key] = copy.deepcopy(top_value)
+                result_dict[key] = _copy(top_value)
         else:
-            result_dict[key] = copy.deepcopy(bottom_dict[key])
+            result_dict[key] = _copy(bottom_dict[key])
     return result_dict
+
+
+def _get_dict_overlay(top_dict, bottom_dict):
+    """Like `_get_dict_union()`, but share the values of both dicts
+    instead of copying them. The result must not be modified.
+    """
+    result_dict = dict(bottom_dict)
+    for key, top_value in top_dict.items():
+        bottom_value = result_dict.get(key)
+        if isinstance(top_value, dict) and isinstance(bottom_value, dict):
+            result_dict[key] = _get_dict_overlay(top_value, bottom_value)
+        else:
+            result_dict[key] = top_value
+    return result_dict
+
+
+def _parse_json(data, memory_optimized):
+    """Parse the JSON text `data`, returning the value and how many bytes
+    of parsed strings were replaced by an equal interned string. With
+    `memory_optimized`, keys and short strings are interned and long
+    numeric lists are stored as arrays.
+    """
+    if not memory_optimized:
+        # Plain dicts are parsed much faster, and are converted when copied
+        # into the user config.
+        return json.loads(data), 0
+    interned_bytes = 0
+
+    def _intern(string):
+        nonlocal interned_bytes
+        interned = sys.intern(string)
+        if interned is not string:
+            interned_bytes += sys.getsizeof(string)
+        return interned
+
+    value = json.loads(
+        data,
+        object_pairs_hook=lambda pairs: _ConfigDict(
+            (_intern(key), _optimize(item, _intern)) for key, item in pairs
+        ),
+    )
+    return value, interned_bytes
+
+
+def _optimize(value, intern):
+    # Exact types, since a bool is an int but must not become one.
+    # pylint: disable=unidiomatic-typecheck
+    if isinstance(value, str):
+        return intern(value) if len(value) <= INTERN_MAX_LENGTH else value
+    if type(value) is list:
+        if len(value) >= COMPACT_MIN_LENGTH:
+            for item_type, typecode in ((int, "q"), (float, "d")):
+                if all(type(item) is item_type for item in value):
+                    try:
+                        return _CompactList(typecode, value)
+                    except OverflowError:
+                        break
+        return _ConfigList(_optimize(item, intern) for item in value)
+    return value
+
+
+def _add_memory_stats(value, stats, seen_strings, seen_containers):
+    # pylint: disable=protected-access
+    if isinstance(value, dict):
+        if id(value) in seen_containers:
+            return
+        seen_containers.add(id(value))
+        for key, item in value.items():
+            _add_memory_stats(key, stats, seen_strings, seen_containers)
+            _add_memory_stats(item, stats, seen_strings, seen_containers)
+    elif isinstance(value, list):
+        for item in value:
+            _add_memory_stats(item, stats, seen_strings, seen_containers)
+    elif isinstance(value, _CompactList):
+        if isinstance(value._items, array.array):
+            stats["compact_lists"] += 1
+            stats["compact_items"] += len(value)
+            # Small ints are shared by Python anyway.
+            stats["compact_list_bytes_saved"] += (
+                sys.getsizeof(list(value))
+                + sum(
+                    sys.getsizeof(item)
+                    for item in value
+                    if not (isinstance(item, int) and -5 <= item <= 256)
+                )
+                - sys.getsizeof(value)
+            )
+        else:
+            _add_memory_stats(value._items, stats, seen_strings, seen_containers)
+    elif isinstance(value, str):
+        stats["strings"] += 1
+        if id(value) in seen_strings:
+            stats["shared_string_bytes"] += sys.getsizeof(value)
+        else:
+            seen_strings.add(id(value))
+            stats["unique_strings"] += 1
+
+
+def _find_includes(value):
+    """Return the include paths found anywhere in `value`."""
+    includes = []
+    if isinstance(value, dict):
+        if INCLUDE_KEY in value:
+            if isinstance(value[INCLUDE_KEY], str):
+                includes.append(value[INCLUDE_KEY])
+            else:
+                includes.extend(value[INCLUDE_KEY])
+        for item in value.values():
+            includes.extend(_find_includes(item))
+    elif isinstance(value, list):
+        for item in value:
+            includes.extend(_find_includes(item))
+    return includes
+
+
+def _reconcile(  # pylint: disable=too-many-arguments
+    parent, key, old_value, new_value, path, *, changes
+):
+    """Make `parent[key]` equal to `new_value`, descending into dicts
+    present on both sides and replacing only the values that differ.
+    Record the changes in `changes`. If `parent` is None, only record.
+    """
+    if new_value is _ABSENT:
+        if old_value is not _ABSENT:
+            changes.removed.append(path)
+            if parent is not None:
+                del parent[key]
+    elif old_value is _ABSENT:
+        changes.added.append(path)
+        if parent is not None:
+            parent[key] = new_value
+    elif _values_equal(old_value, new_value):
+        return
+    elif isinstance(old_value, dict) and isinstance(new_value, dict):
+        child_parent = None if parent is None else old_value
+        child_keys = list(old_value)
+        child_keys.extend(key for key in new_value if key not in old_value)
+        for child_key in child_keys:
+            _reconcile(
+                child_parent,
+                child_key,
+                old_value.get(child_key, _ABSENT),
+                new_value.get(child_key, _ABSENT),
+                path + (child_key,),
+                changes=changes,
+            )
+    else:
+        changes.modified.append(path)
+        if parent is not None:
+            parent[key] = new_value
+
+
+def _get_path_changes(path, old_value, new_value, changes):
+    """Append journal records that turn `old_value` into `new_value`."""
+    if isinstance(old_value, dict) and isinstance(new_value, dict):
+        for key in old_value:
+            if key not in new_value:
+                changes.append({"path": list(path + (key,))})
+        for key, value in new_value.items():
+            _get_path_changes(
+                path + (key,), old_value.get(key, _ABSENT), value, changes
+            )
+    elif new_value is _ABSENT:
+        if old_value is not _ABSENT:
+            changes.append({"path": list(path)})
+    elif old_value is _ABSENT or old_value != new_value:
+        changes.append({"path": list(path), "value": new_value})
+
+
+def _apply_change(dict_, change):
+    *parent_keys, key = change["path"]
+    for parent_key in parent_keys:
+        child = dict_.get(parent_key)
+        if not isinstance(child, dict):
+            if "value" not in change:
+                return
+            child = dict_[parent_key] = {}
+        dict_ = child
+    if "value" in change:
+        dict_[key] = change["value"]
+    else:
+        dict_.pop(key, None)
+
+
+def _read_journal(path, dict_, truncate=False):
+    """Apply the journal records at `path` to `dict_`, stopping at the
+    first torn or corrupt record. Return the number of records applied
+    and the size of the intact part of the journal.
+    """
+    try:
+        with path.open(mode="rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return 0, 0
+
+    records = 0
+    offset = 0
+    while True:
+        end = data.find(b"\n", offset)
+        if end == -1:
+            break
+        try:
+            change = json.loads(data[offset:end].decode("utf-8"))
+        except ValueError:
+            break
+        _apply_change(dict_, change)
+        records += 1
+        offset = end + 1
+
+    if truncate and offset < len(data):
+        with path.open(mode="r+b") as file:
+            file.truncate(offset)
+    return records, offset
+
+
+def _get_shard_filename(shard):
+    digest = hashlib.sha1(shard.encode("utf-8")).hexdigest()[:8]
+    return f"{urllib.parse.quote(shard, safe='')[:64]}.{digest}.json"
+
+
+def _get_text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def _write_atomically(path, text, compression_level=None):
+    """Replace the file at `path` so that readers, and the file system
+    after a crash, see either the old or the new contents in full. The
+    file keeps its permissions, or gets the usual ones if it is new.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    file_descriptor, temp_path = tempfile.mkstemp(
+        dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        # mkstemp() creates files that only the owner can read.
+        os.chmod(temp_path, mode)
+        try:
+            with os.fdopen(file_descriptor, "wb", closefd=False) as raw_file:
+                with _wrap_file(path, raw_file, "w", compression_level) as file:
+                    file.write(text)
+            os.fsync(file_descriptor)
+        finally:
+            os.close(file_descriptor)
+        os.replace(temp_path, str(path))
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _find_config_file(path):
+    """Return `path`, or failing that the first compressed variant of it
+    that exists, such as `path` with ".gz" appended.
+    """
+    if path.exists():
+        return path
+    for suffix in COMPRESSION_SUFFIXES:
+        compressed_path = path.with_name(path.name + suffix)
+        if compressed_path.exists():
+            return compressed_path
+    return path
+
+
+def _wrap_file(path, file, mode, compression_level=None):
+    """Wrap the binary `file` in a text stream for reading (`mode` "r")
+    or writing ("w") the config file at `path`, which is decompressed or
+    compressed if its extension calls for it.
+    """
+    if path.suffix == ".gz":
+        file = gzip.GzipFile(
+            fileobj=file,
+            mode=mode + "b",
+            compresslevel=9 if compression_level is None else compression_level,
+        )
+    elif path.suffix == ".zst":
+        if zstandard is None:
+            raise ValueError(
+                f"Cannot read or write '{path}' without the zstandard package."
+            )
+        if mode == "r":
+            file = zstandard.ZstdDecompressor().stream_reader(file, closefd=False)
+        else:
+            file = zstandard.ZstdCompressor(
+                level=3 if compression_level is None else compression_level
+            ).stream_writer(file, closefd=False)
+    else:
+        return io.TextIOWrapper(file)
+    return io.TextIOWrapper(file, encoding="utf-8")
+
+
+def _to_string(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, _ConfigItemProxy):
+        value = value.get_dict()
+    return json.dumps(value, default=_to_json)
+
+
+def _to_json(value):
+    """Serialize the list-compatible types that json does not know about."""
+    if isinstance(value, _CompactList):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _paths_overlap(path, other_path):
+    """Return True if either path is the other or lies below it."""
+    length = min(len(path), len(other_path))
+    return path[:length] == other_path[:length]
+
+
+def _split_path(path):
+    if isinstance(path, str):
+        return path.split(".")
+    return list(path)
+
+
+def _track(value, parent):
+    """Return `value` as a fingerprinted container owned by `parent`,
+    copying it if it is a plain container or belongs to someone else.
+    """
+    # pylint: disable=protected-access
+    if type(value) in _SCALAR_TYPES:
+        return value
+    if isinstance(value, _TRACKED_TYPES):
+        if value._parent is not None and value._parent is not parent:
+            value = copy.deepcopy(value)
+        value._parent = parent
+        return value
+    if isinstance(value, dict):
+        value = _ConfigDict(value)
+    elif isinstance(value, list):
+        value = _ConfigList(value)
+    elif type(value) is tuple:  # pylint: disable=unidiomatic-typecheck
+        return tuple(_track(item, parent) for item in value)
+    else:
+        return value
+    value._parent = parent
+    return value
+
+
+def _copy(value):
+    """Return a deep copy of `value` made of fingerprinted containers."""
+    if isinstance(value, _TRACKED_TYPES):
+        return copy.deepcopy(value)
+    # Plain containers are copied as they are converted.
+    return _track(value, None)
+
+
+def _encode_value(value):
+    """Encode `value` such that equal values have equal encodings."""
+    # The most common types first, since this is called for every value.
+    if isinstance(value, str):
+        data = value.encode("utf-8", "surrogatepass")
+        return b"s%d:" % len(data) + data
+    if isinstance(value, int):
+        return b"i%d;" % value
+    if isinstance(value, (dict, list, tuple, _CompactList)):
+        return b"c" + _get_fingerprint(value)
+    if value is None:
+        return b"n"
+    if isinstance(value, float) and value.is_integer():
+        return b"i%d;" % int(value)
+    return b"f" + repr(float(value)).encode("ascii") + b";"
+
+
+def _compute_fingerprint(value):
+    if isinstance(value, dict):
+        # Keys encode differently, so the values are never compared.
+        data = b"d" + b"".join(
+            encoded_key + encoded_item
+            for encoded_key, encoded_item in sorted(
+                (_encode_value(key), _encode_value(item))
+                for key, item in value.items()
+            )
+        )
+    elif isinstance(value, (list, tuple, _CompactList)):
+        data = (b"t" if isinstance(value, tuple) else b"l") + b"".join(
+            _encode_value(item) for item in value
+        )
+    else:
+        data = _encode_value(value)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _get_fingerprint(value):
+    if isinstance(value, _TRACKED_TYPES):
+        return value.fingerprint()
+    return _compute_fingerprint(value)
+
+
+def _values_equal(value, other):
+    """Compare by fingerprint where both values have one cached already,
+    since computing fingerprints costs more than comparing once.
+    """
+    # pylint: disable=protected-access
+    if (
+        isinstance(value, _TRACKED_TYPES)
+        and isinstance(other, _TRACKED_TYPES)
+        and value._fingerprint is not None
+        and other._fingerprint is not None
+    ):
+        return value._fingerprint == other._fingerprint
+    return value == other
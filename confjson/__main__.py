@@ -0,0 +1,7 @@
+# pylint: disable=missing-docstring
+import sys
+
+from confjson.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
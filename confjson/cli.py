@@ -0,0 +1,221 @@
+"""Command-line interface for inspecting and editing confjson configs."""
+import argparse
+import collections.abc
+import json
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+import confjson
+
+
+def main(argv=None):
+    """Run the command line given by `argv`, or by `sys.argv`."""
+    parser = _get_parser()
+    args = parser.parse_args(argv)
+    try:
+        args.command(args)
+    except KeyError as error:
+        parser.exit(1, f"{parser.prog}: error: no such key: {error}\n")
+    except (TypeError, ValueError) as error:
+        parser.exit(1, f"{parser.prog}: error: {error}\n")
+    return 0
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m confjson", description=confjson.__doc__
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        default=".",
+        help="config directory (default: current directory)",
+    )
+    parser.add_argument(
+        "--user-config-filename", default=confjson.USER_CONFIG_FILENAME
+    )
+    parser.add_argument(
+        "--default-config-filename", default=confjson.DEFAULT_CONFIG_FILENAME
+    )
+    parser.add_argument("--sharded", action="store_true", help="use sharded storage")
+    parser.add_argument("--journal", action="store_true", help="use journal mode")
+    subparsers = parser.add_subparsers(dest="command_name")
+    subparsers.required = True
+
+    get_parser = subparsers.add_parser("get", help="print the value at a path")
+    get_parser.add_argument("path", help="dotted path, such as database.host")
+    get_parser.set_defaults(command=_get)
+
+    set_parser = subparsers.add_parser("set", help="set and save the value at a path")
+    set_parser.add_argument("path", help="dotted path, such as database.host")
+    set_parser.add_argument(
+        "value", help="JSON value; anything that is not valid JSON is a string"
+    )
+    set_parser.set_defaults(command=_set)
+
+    diff_parser = subparsers.add_parser(
+        "diff", help="print the user settings that differ from the defaults"
+    )
+    diff_parser.add_argument("path", nargs="?", help="only show this dotted path")
+    diff_parser.set_defaults(command=_diff)
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="time loading, accessing and saving the config"
+    )
+    bench_parser.add_argument(
+        "-n", "--iterations", type=_positive_int, default=10, help="(default: 10)"
+    )
+    bench_parser.set_defaults(command=_bench)
+
+    profile_parser = subparsers.add_parser(
+        "profile", help="report parse time and memory footprint of the config"
+    )
+    profile_parser.add_argument(
+        "-t", "--top", type=int, default=10, help="largest subtrees to list"
+    )
+    profile_parser.set_defaults(command=_profile)
+    return parser
+
+
+def _positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+
+def _load_config(args, directory=None):
+    return confjson.Config(
+        args.directory if directory is None else directory,
+        user_config_filename=args.user_config_filename,
+        default_config_filename=args.default_config_filename,
+        sharded=args.sharded,
+        journal=args.journal,
+    )
+
+
+def _print_json(value):
+    print(json.dumps(value, indent=4, sort_keys=True))
+
+
+def _get(args):
+    _print_json(_load_config(args).get_path(args.path))
+
+
+def _set(args):
+    try:
+        value = json.loads(args.value)
+    except ValueError:
+        value = args.value
+    config = _load_config(args)
+    config.set_path(args.path, value)
+    config.save()
+
+
+def _diff(args):
+    try:
+        diff = _load_config(args).diff(args.path)
+    except KeyError:
+        return
+    _print_json(diff)
+
+
+def _bench(args):
+    timings = {"load": [], "access": [], "save": []}
+    # Resolved by Config, since the path may be that of a file.
+    source_directory = _load_config(args).directory
+    with tempfile.TemporaryDirectory() as temp_directory:
+        # Save to a copy, so that benchmarking leaves the real config alone.
+        directory = pathlib.Path(temp_directory) / "config"
+        shutil.copytree(str(source_directory), str(directory))
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            config = _load_config(args, directory)
+            timings["load"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            # Config has no items(), so this cannot iterate over it.
+            for key in config.keys():  # pylint: disable=consider-using-dict-items
+                _walk(config[key])
+            timings["access"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            config.save()
+            timings["save"].append(time.perf_counter() - start)
+
+    print(f"{'operation':<10}{'min ms':>12}{'mean ms':>12}{'max ms':>12}")
+    for operation, seconds in timings.items():
+        print(
+            f"{operation:<10}{min(seconds) * 1000:>12.3f}"
+            f"{sum(seconds) / len(seconds) * 1000:>12.3f}"
+            f"{max(seconds) * 1000:>12.3f}"
+        )
+
+
+def _walk(value):
+    """Access every item below `value` the way application code would."""
+    items = getattr(value, "items", None)
+    if items is not None:
+        for _, item in items():
+            _walk(item)
+    elif isinstance(value, collections.abc.MutableSequence):
+        for item in value:
+            _walk(item)
+
+
+def _profile(args):
+    config = _load_config(args)
+    parse_times = {}
+    paths = [config.default_config_path]
+    paths.extend(
+        config.default_config_path.with_name(config.default_config_path.name + suffix)
+        for suffix in confjson.COMPRESSION_SUFFIXES
+    )
+    paths.append(config.user_config_path)
+    for path in paths:
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            continue
+        start = time.perf_counter()
+        # A fresh cache, so that the file is really read and parsed.
+        confjson.FragmentCache().load(path)
+        parse_times[path.name] = (time.perf_counter() - start, size)
+
+    subtree_sizes = []
+    key_sizes = {
+        key: _get_size(config.get_path([key]), (key,), subtree_sizes)
+        for key in config.keys()
+    }
+
+    print("Parse time:")
+    for name, (seconds, length) in parse_times.items():
+        print(f"  {name}: {seconds * 1000:.3f} ms ({length} bytes)")
+    print("Memory by top-level key:")
+    for key, size in sorted(key_sizes.items(), key=lambda item: -item[1]):
+        print(f"  {key}: {size} bytes")
+    print(f"  total: {sum(key_sizes.values())} bytes")
+    print("Largest subtrees:")
+    subtree_sizes.sort(key=lambda item: -item[0])
+    for size, path in subtree_sizes[: args.top]:
+        print(f"  {'.'.join(str(key) for key in path)}: {size} bytes")
+
+
+def _get_size(value, path, subtree_sizes):
+    """Return the approximate memory footprint of `value`, appending
+    that of every dict and list inside it to `subtree_sizes`.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + _get_size(item, path + (key,), subtree_sizes)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            size += _get_size(item, path + (index,), subtree_sizes)
+    else:
+        return size
+    subtree_sizes.append((size, path))
+    return size
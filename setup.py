@@ -15,6 +15,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/skunkfrukt/confjson",
     packages=setuptools.find_packages(),
+    extras_require={"zstd": ["zstandard"]},
     classifiers=[
         "Intended Audience :: Developers",
         "Programming Language :: Python :: 3.6",
@@ -0,0 +1,114 @@
+# pylint: disable=missing-docstring
+import gzip
+import json
+import os.path
+
+import pytest
+
+import confjson
+from confjson.cli import main
+
+
+DEFAULT_CONFIG = {
+    "database": {"host": "localhost", "port": 5432},
+    "features": {"search": {"enabled": False}},
+    "name": "app",
+}
+
+
+@pytest.fixture(name="config_dir")
+def _config_dir(tmpdir):
+    path = os.path.join(tmpdir, confjson.DEFAULT_CONFIG_FILENAME)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(DEFAULT_CONFIG, file)
+    return str(tmpdir)
+
+
+def _run(capsys, *argv):
+    assert main(list(argv)) == 0
+    return capsys.readouterr().out
+
+
+def test_get(config_dir, capsys):
+    assert json.loads(_run(capsys, "-d", config_dir, "get", "database.port")) == 5432
+    assert json.loads(_run(capsys, "-d", config_dir, "get", "database")) == (
+        DEFAULT_CONFIG["database"]
+    )
+
+
+def test_get_missing(config_dir, capsys):
+    with pytest.raises(SystemExit) as excinfo:
+        main(["-d", config_dir, "get", "database.user"])
+    assert excinfo.value.code == 1
+    assert "no such key: 'user'" in capsys.readouterr().err
+
+
+def test_set(config_dir, capsys):
+    _run(capsys, "-d", config_dir, "set", "database.port", "6543")
+    _run(capsys, "-d", config_dir, "set", "features.new.name", "fancy")
+    conf = confjson.Config(config_dir)
+    assert conf.database.port == 6543
+    assert conf.features.new.name == "fancy"
+    assert conf.features.search.enabled is False
+
+
+def test_set_below_non_dict(config_dir):
+    with pytest.raises(SystemExit):
+        main(["-d", config_dir, "set", "name.first", "1"])
+
+
+def test_diff(config_dir, capsys):
+    _run(capsys, "-d", config_dir, "set", "database.port", "6543")
+    _run(capsys, "-d", config_dir, "set", "name", '"other"')
+    assert json.loads(_run(capsys, "-d", config_dir, "diff")) == {
+        "database": {"port": 6543},
+        "name": "other",
+    }
+    assert json.loads(_run(capsys, "-d", config_dir, "diff", "database")) == {
+        "port": 6543
+    }
+    assert not _run(capsys, "-d", config_dir, "diff", "features.search")
+
+
+def test_bench(config_dir, capsys):
+    output = _run(capsys, "-d", config_dir, "bench", "-n", "2")
+    for operation in ("load", "access", "save"):
+        assert operation in output
+    assert not os.path.exists(os.path.join(config_dir, confjson.USER_CONFIG_FILENAME))
+
+
+def test_bench_config_file(config_dir, capsys):
+    path = os.path.join(config_dir, confjson.DEFAULT_CONFIG_FILENAME)
+    assert "save" in _run(capsys, "-d", path, "bench", "-n", "1")
+
+
+def test_bench_invalid_arguments(config_dir, capsys):
+    with pytest.raises(SystemExit) as excinfo:
+        main(["-d", config_dir, "bench", "-n", "0"])
+    assert excinfo.value.code == 2
+    assert "must be at least 1" in capsys.readouterr().err
+    with pytest.raises(SystemExit) as excinfo:
+        main(["-d", os.path.join(config_dir, "missing"), "bench"])
+    assert excinfo.value.code == 1
+    assert "does not exist" in capsys.readouterr().err
+
+
+def test_profile(config_dir, capsys):
+    _run(capsys, "-d", config_dir, "set", "database.replicas", "[1, 2]")
+    output = _run(capsys, "-d", config_dir, "profile", "--top", "3")
+    assert confjson.DEFAULT_CONFIG_FILENAME in output
+    assert confjson.USER_CONFIG_FILENAME in output
+    assert "Memory by top-level key:\n  database:" in output
+    largest = output.split("Largest subtrees:\n")[1].splitlines()
+    assert len(largest) == 3
+    assert largest[0].strip().startswith("database:")
+
+
+def test_profile_compressed(tmpdir, capsys):
+    with gzip.open(
+        os.path.join(tmpdir, confjson.DEFAULT_CONFIG_FILENAME + ".gz"), "wt"
+    ) as file:
+        json.dump(DEFAULT_CONFIG, file)
+    output = _run(capsys, "-d", str(tmpdir), "profile")
+    assert confjson.DEFAULT_CONFIG_FILENAME + ".gz" in output
+    assert "\n  database:" in output
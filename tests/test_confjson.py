@@ -1,6 +1,12 @@
-# pylint: disable=missing-docstring
+# pylint: disable=missing-docstring,too-many-lines
+import copy
+import gzip
 import json
 import os.path
+import pathlib
+import pickle
+import threading
+import time
 
 import pytest
 
@@ -648,3 +654,1308 @@ def test_placeholder_setitem(tmpdir):
     assert not igur["fake_dict"].is_placeholder
     assert not igur["fake_dict"]["fake_key"].is_placeholder
     assert igur["fake_dict"]["fake_key"]["fake_subkey"] == "._. much placeholder"
+
+
+def test_placeholders_are_reused(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir, use_placeholders=True)
+    missing = conf.fake_dict.fake_key.fake_subkey
+    assert conf.fake_dict.fake_key.fake_subkey is missing
+    assert conf["fake_dict"]["fake_key"]["fake_subkey"] is missing
+    nested = conf.dict_in_both.fake_key.fake_subkey
+    assert conf.dict_in_both.fake_key.fake_subkey is nested
+    conf.load()
+    assert conf.fake_dict.fake_key.fake_subkey is not missing
+    assert conf.fake_dict.fake_key.fake_subkey.is_placeholder
+
+
+def test_reused_placeholders_after_changes(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir, use_placeholders=True)
+    placeholder = conf.fake_dict.fake_key
+    other = conf.fake_dict.other_key
+    placeholder.fake_subkey = 1
+    assert conf.fake_dict.fake_key.fake_subkey == 1
+    assert not placeholder.is_placeholder
+    assert conf.fake_dict.other_key is not other
+    assert conf.fake_dict.other_key.is_placeholder
+    del conf["fake_dict"]
+    assert conf.fake_dict.fake_key.is_placeholder
+    assert conf.fake_dict.fake_key is not placeholder
+
+    nested = conf.dict_in_both.fake_key
+    conf.dict_in_both.fake_key = "set"
+    assert conf.dict_in_both.fake_key == "set"
+    conf.set_path("dict_in_both", {})
+    assert conf.dict_in_both.fake_key is not nested
+    # Replacing a dict behind the config's back is noticed as well.
+    missing = conf.dict_in_both.nested.fake_key
+    conf.dict_in_both.get_dict()["nested"] = {}
+    conf.dict_in_both.nested.fake_key.value = 1
+    assert missing.is_placeholder
+    assert conf.get_path("dict_in_both.nested.fake_key.value") == 1
+
+
+def test_placeholder_cache_is_bounded(tmpdir, monkeypatch):
+    # pylint: disable=protected-access
+    monkeypatch.setattr(confjson, "PLACEHOLDER_CACHE_SIZE", 4)
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir, use_placeholders=True)
+    missing = conf.fake_dict.fake_key
+    for index in range(10):
+        assert conf.fake_dict[f"key{index}"].fake_subkey.is_placeholder
+        assert conf.dict_in_both[f"key{index}"].is_placeholder
+        assert conf._placeholder_count <= 4
+    assert conf.fake_dict.fake_key is not missing
+    nested = conf.dict_in_both.fake_key
+    assert conf.dict_in_both.fake_key is nested
+
+
+def test_get_missing_key(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir)
+    assert conf.get("does_not_exist") is None
+    assert conf.get("does_not_exist", 1) == 1
+    assert conf.get("string_in_default", 1) == DEFAULT_CONFIG["string_in_default"]
+    conf = confjson.Config(tmpdir, use_placeholders=True)
+    assert conf.get("does_not_exist").is_placeholder
+
+
+def _read_manifest(conf):
+    with (conf.shard_directory / confjson.MANIFEST_FILENAME).open() as file:
+        return json.load(file)["shards"]
+
+
+def _read_shard(conf, key):
+    for entry in _read_manifest(conf).values():
+        if key in entry["keys"]:
+            with (conf.shard_directory / entry["file"]).open() as file:
+                return json.load(file)
+    raise KeyError(key)
+
+
+def test_sharded_save_writes_one_shard_per_key(tmpdir):
+    _generate_default_config(tmpdir)
+    conf = confjson.Config(tmpdir, sharded=True)
+    conf["string_in_user"] = "krafs"
+    conf["dict_in_both"]["key_in_both"] = "new_value"
+    conf.save()
+    assert not conf.user_config_path.exists()
+    assert len(_read_manifest(conf)) == 2
+    assert _read_shard(conf, "string_in_user") == {"string_in_user": "krafs"}
+    assert _read_shard(conf, "dict_in_both") == {
+        "dict_in_both": {"key_in_both": "new_value"}
+    }
+
+
+def test_sharded_save_groups_keys(tmpdir):
+    conf = confjson.Config(tmpdir, shard_groups={"group": ["a", "b"]})
+    conf["a"] = 1
+    conf["b"] = 2
+    conf["c"] = 3
+    conf.save()
+    manifest = _read_manifest(conf)
+    assert manifest["group"]["keys"] == ["a", "b"]
+    assert manifest["c"]["keys"] == ["c"]
+
+
+def test_sharded_load_is_lazy(tmpdir):
+    conf = confjson.Config(tmpdir, sharded=True)
+    conf["a"] = {"b": 1}
+    conf["c"] = 2
+    conf.save()
+    igur = confjson.Config(tmpdir, sharded=True)
+    assert set(igur.keys()) == {"a", "c"}
+    assert "a" in igur
+    assert "a" not in igur._user_dict  # pylint: disable=protected-access
+    assert igur.a.b == 1
+    assert "c" not in igur._user_dict  # pylint: disable=protected-access
+    assert igur["c"] == 2
+
+
+def test_sharded_save_rewrites_only_modified_shards(tmpdir, monkeypatch):
+    conf = confjson.Config(tmpdir, sharded=True)
+    conf["a"] = 1
+    conf["b"] = 2
+    conf.save()
+    written = []
+    write = confjson._write_atomically  # pylint: disable=protected-access
+
+    def _record_write(path, text):
+        written.append(path.name)
+        write(path, text)
+
+    monkeypatch.setattr(confjson, "_write_atomically", _record_write)
+    igur = confjson.Config(tmpdir, sharded=True)
+    igur["a"] = 3
+    igur.save()
+    assert written == [_read_manifest(igur)["a"]["file"]]
+    written.clear()
+    igur.save()
+    assert not written
+    assert confjson.Config(tmpdir, sharded=True)["a"] == 3
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Windows has no permission bits")
+def test_save_keeps_file_permissions(tmpdir):
+    umask = os.umask(0)
+    os.umask(umask)
+    conf = confjson.Config(tmpdir, sharded=True)
+    conf["a"] = 1
+    conf.save()
+    shard_path = conf.shard_directory / _read_manifest(conf)["a"]["file"]
+    for path in (conf.shard_directory / confjson.MANIFEST_FILENAME, shard_path):
+        assert path.stat().st_mode & 0o777 == 0o666 & ~umask
+    shard_path.chmod(0o640)
+    conf["a"] = 2
+    conf.save()
+    assert shard_path.stat().st_mode & 0o777 == 0o640
+
+
+def test_sharded_save_serializes_only_modified_shards(tmpdir, monkeypatch):
+    conf = confjson.Config(tmpdir, sharded=True)
+    for index in range(5):
+        conf[f"key{index}"] = {"values": [index]}
+    conf.save()
+    reloaded = confjson.Config(tmpdir, sharded=True)
+    items = [reloaded[f"key{index}"] for index in range(5)]
+    hashed = []
+    get_text_hash = confjson._get_text_hash  # pylint: disable=protected-access
+
+    def _record_hash(text):
+        hashed.append(text)
+        return get_text_hash(text)
+
+    monkeypatch.setattr(confjson, "_get_text_hash", _record_hash)
+    reloaded["key0"] = {"values": []}
+    reloaded.save()
+    assert len(hashed) == 1
+    hashed.clear()
+    reloaded.save()
+    assert not hashed
+    # Items handed out before a save are still saved when changed in place.
+    items[1]["values"].append(10)
+    reloaded.save()
+    assert len(hashed) == 1
+    assert confjson.Config(tmpdir, sharded=True).key1["values"] == [1, 10]
+
+
+def test_sharded_save_removes_shards_matching_defaults(tmpdir):
+    _generate_default_config(tmpdir)
+    conf = confjson.Config(tmpdir, sharded=True)
+    conf["string_in_default"] = "krafs"
+    conf["new_key"] = "new_value"
+    conf.save()
+    filename = _read_manifest(conf)["string_in_default"]["file"]
+    igur = confjson.Config(tmpdir, sharded=True)
+    igur["string_in_default"] = DEFAULT_CONFIG["string_in_default"]
+    del igur["new_key"]
+    igur.save()
+    assert not _read_manifest(igur)
+    assert not (igur.shard_directory / filename).exists()
+    assert "new_key" not in confjson.Config(tmpdir, sharded=True)
+
+
+def test_sharded_save_migrates_user_config_file(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir, sharded=True)
+    conf.save()
+    assert not conf.user_config_path.exists()
+    igur = confjson.Config(tmpdir, sharded=True)
+    for key, value in USER_CONFIG.items():
+        assert _read_shard(igur, key)[key] == value
+    assert igur["string_in_user"] == USER_CONFIG["string_in_user"]
+    assert igur.dict_in_both.key_in_default == DEFAULT_CONFIG["dict_in_both"][
+        "key_in_default"
+    ]
+
+
+def _read_journal_records(conf):
+    with conf.journal_path.open() as file:
+        return [json.loads(line) for line in file]
+
+
+def test_journal_save_appends_changed_paths_only(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir, journal=True)
+    conf["dict_in_both"]["nested_dict_in_both"]["key_in_both"] = "new_value"
+    conf["string_in_user"] = "krafs"
+    del conf["list_in_user"]
+    conf.save()
+    with conf.user_config_path.open() as file:
+        assert json.load(file) == USER_CONFIG
+    records = _read_journal_records(conf)
+    assert len(records) == 3
+    assert {
+        "path": ["dict_in_both", "nested_dict_in_both", "key_in_both"],
+        "value": "new_value",
+    } in records
+    assert {"path": ["string_in_user"], "value": "krafs"} in records
+    assert {"path": ["list_in_user"]} in records
+    conf.save()
+    assert len(_read_journal_records(conf)) == 3
+
+
+def test_journal_load_replays_records(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir, journal=True)
+    conf["dict_in_default"]["new_key"] = "new_value"
+    conf["string_in_user"] = "krafs"
+    del conf["list_in_user"]
+    conf.save()
+    igur = confjson.Config(tmpdir, journal=True)
+    assert igur["dict_in_default"]["new_key"] == "new_value"
+    assert igur["string_in_user"] == "krafs"
+    assert "list_in_user" not in igur
+
+
+def test_journal_load_tolerates_torn_record(tmpdir):
+    conf = confjson.Config(tmpdir, journal=True)
+    conf["a"] = 1
+    conf.save()
+    with conf.journal_path.open(mode="a") as file:
+        file.write('{"path":["b"],"val')
+    igur = confjson.Config(tmpdir, journal=True)
+    assert igur["a"] == 1
+    assert "b" not in igur
+    igur["c"] = 2
+    igur.save()
+    assert _read_journal_records(igur) == [
+        {"path": ["a"], "value": 1},
+        {"path": ["c"], "value": 2},
+    ]
+
+
+def test_journal_compaction_after_record_threshold(tmpdir):
+    conf = confjson.Config(tmpdir, journal=True, journal_max_records=3)
+    for value in range(3):
+        conf["counter"] = value
+        conf.save()
+    conf._wait_for_compaction()  # pylint: disable=protected-access
+    assert not conf.journal_path.exists()
+    with conf.user_config_path.open() as file:
+        assert json.load(file) == {"counter": 2}
+    conf["counter"] = 3
+    conf.save()
+    assert _read_journal_records(conf) == [{"path": ["counter"], "value": 3}]
+    assert confjson.Config(tmpdir, journal=True)["counter"] == 3
+
+
+def test_journal_load_during_compaction(tmpdir, monkeypatch):
+    write = confjson._write_atomically  # pylint: disable=protected-access
+
+    def _slow_write(*args):
+        time.sleep(0.2)
+        write(*args)
+
+    monkeypatch.setattr(confjson, "_write_atomically", _slow_write)
+    conf = confjson.Config(tmpdir, journal=True, journal_max_records=2)
+    conf["a"] = 1
+    conf.save()
+    conf["b"] = 2
+    conf.save()
+    conf.load()
+    assert conf.a == 1
+    assert conf.b == 2
+    conf["c"] = 3
+    conf.save()
+    conf.compact()
+    assert confjson.Config(tmpdir)["a"] == 1
+    assert confjson.Config(tmpdir)["c"] == 3
+
+
+def test_journal_save_diffs_only_modified_keys(tmpdir, monkeypatch):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir, journal=True)
+    for key in conf.keys():
+        conf.get(key)
+    conf["string_in_user"] = "krafs"
+    conf.save()
+    diffed = []
+    get_dict_diff = confjson._get_dict_diff  # pylint: disable=protected-access
+
+    def _record_diff(top_dict, bottom_dict):
+        diffed.extend(top_dict)
+        return get_dict_diff(top_dict, bottom_dict)
+
+    monkeypatch.setattr(confjson, "_get_dict_diff", _record_diff)
+    conf["string_in_both"] = "krafs"
+    conf.save()
+    assert diffed == ["string_in_both"]
+    diffed.clear()
+    conf.save()
+    assert not diffed
+    assert confjson.Config(tmpdir, journal=True).string_in_both == "krafs"
+
+
+def test_journal_compact(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir, journal=True)
+    for key in USER_CONFIG:
+        del conf[key]
+    conf.save()
+    conf.compact()
+    assert not conf.journal_path.exists()
+    assert not conf.user_config_path.exists()
+
+
+def test_journal_replays_interrupted_compaction(tmpdir):
+    conf = confjson.Config(tmpdir, journal=True)
+    conf["a"] = {"b": 1}
+    conf.save()
+    # Simulate a crash right after the journal was set aside.
+    conf.journal_path.rename(str(conf.journal_path) + ".1")
+    conf["a"]["c"] = 2
+    conf.save()
+    igur = confjson.Config(tmpdir, journal=True)
+    assert igur["a"] == {"b": 1, "c": 2}
+    igur.compact()
+    assert not os.path.exists(str(igur.journal_path) + ".1")
+    assert confjson.Config(tmpdir)["a"] == {"b": 1, "c": 2}
+
+
+def test_journal_cannot_be_combined_with_shards(tmpdir):
+    with pytest.raises(ValueError):
+        _ = confjson.Config(tmpdir, journal=True, sharded=True)
+
+
+def test_compact_without_journal(tmpdir):
+    _generate_user_config(tmpdir)
+    conf = confjson.Config(tmpdir)
+    conf.compact()
+    assert conf.user_config_path.exists()
+
+
+def test_fingerprint_equal_for_equal_contents(tmpdir):
+    _generate_both_config_files(tmpdir)
+    con = confjson.Config(tmpdir)
+    fig = confjson.Config(tmpdir)
+    assert con.dict_in_both.fingerprint() == fig.dict_in_both.fingerprint()
+    assert con.dict_in_both.fingerprint() != con.dict_in_default.fingerprint()
+    con["numbers"] = {"a": 1, "b": [2.0, True]}
+    fig["numbers"] = {"b": [2, 1], "a": 1.0}
+    assert con.numbers.fingerprint() == fig.numbers.fingerprint()
+    assert con.numbers == fig.numbers
+
+
+def test_fingerprint_invalidated_along_mutation_path(tmpdir):
+    _generate_both_config_files(tmpdir)
+    con = confjson.Config(tmpdir)
+    fig = confjson.Config(tmpdir)
+    before = con.dict_in_both.fingerprint()
+    con.dict_in_both.nested_dict_in_both.key_in_both = "new_value"
+    assert con.dict_in_both.fingerprint() != before
+    assert con.dict_in_both != fig.dict_in_both
+    con.dict_in_both.nested_dict_in_both.key_in_both = fig.dict_in_both[
+        "nested_dict_in_both"
+    ]["key_in_both"]
+    assert con.dict_in_both.fingerprint() == before
+    assert con.dict_in_both == fig.dict_in_both
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        pytest.param(lambda list_: list_.append("x"), id="append"),
+        pytest.param(lambda list_: list_.extend(["x"]), id="extend"),
+        pytest.param(lambda list_: list_.insert(0, "x"), id="insert"),
+        pytest.param(lambda list_: list_.pop(), id="pop"),
+        pytest.param(lambda list_: list_.remove(list_[0]), id="remove"),
+        pytest.param(lambda list_: list_.reverse(), id="reverse"),
+        pytest.param(lambda list_: list_.sort(reverse=True), id="sort"),
+        pytest.param(lambda list_: list_.clear(), id="clear"),
+        pytest.param(lambda list_: list_.__setitem__(0, "x"), id="setitem"),
+        pytest.param(lambda list_: list_.__setitem__(slice(0, 1), "x"), id="slice"),
+        pytest.param(lambda list_: list_.__delitem__(0), id="delitem"),
+        pytest.param(lambda list_: list_.__iadd__(["x"]), id="iadd"),
+        pytest.param(lambda list_: list_.__imul__(2), id="imul"),
+    ],
+)
+def test_fingerprint_invalidated_by_list_mutation(tmpdir, mutate):
+    conf = confjson.Config(tmpdir)
+    conf["outer"] = {"inner": {"list": ["a", "b"]}}
+    before = conf.outer.fingerprint()
+    mutate(conf.outer.inner.list)
+    assert conf.outer.fingerprint() != before
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        pytest.param(lambda dict_: dict_.pop("a"), id="pop"),
+        pytest.param(lambda dict_: dict_.popitem(), id="popitem"),
+        pytest.param(lambda dict_: dict_.clear(), id="clear"),
+        pytest.param(lambda dict_: dict_.setdefault("b", 2), id="setdefault"),
+        pytest.param(lambda dict_: dict_.update(b=2), id="update"),
+        pytest.param(lambda dict_: dict_.__ior__({"b": 2}), id="ior"),
+        pytest.param(lambda dict_: dict_.__delitem__("a"), id="delitem"),
+    ],
+)
+def test_fingerprint_invalidated_by_dict_mutation(tmpdir, mutate):
+    conf = confjson.Config(tmpdir)
+    conf["outer"] = {"inner": {"a": 1}}
+    before = conf.outer.fingerprint()
+    mutate(conf.outer.inner.get_dict())
+    assert conf.outer.fingerprint() != before
+
+
+def test_fingerprint_of_placeholder(tmpdir):
+    conf = confjson.Config(tmpdir, use_placeholders=True)
+    assert conf.does_not_exist.fingerprint() is None
+
+
+def test_config_values_can_be_pickled(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir)
+    nested = conf.dict_in_both.nested_dict_in_both
+    for value in (conf.dict_in_both.get_dict(), conf.list_in_both, nested.get_dict()):
+        unpickled = pickle.loads(pickle.dumps(value))
+        assert unpickled == value
+        assert type(unpickled) is type(value)
+    unpickled = pickle.loads(pickle.dumps(conf.dict_in_both.get_dict()))
+    before = unpickled.fingerprint()
+    unpickled["nested_dict_in_both"]["key_in_both"] = "new_value"
+    assert unpickled.fingerprint() != before
+
+
+def test_config_values_copy_shallowly(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir)
+    dict_ = conf.dict_in_both.get_dict()
+    shallow = copy.copy(dict_)
+    assert shallow == dict_
+    assert shallow["nested_dict_in_both"] is dict_["nested_dict_in_both"]
+    assert copy.copy(conf.list_in_both) == conf.list_in_both
+
+
+def test_reload_keeps_unchanged_dicts_and_live_proxies(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir)
+    nested = conf.dict_in_both.nested_dict_in_both
+    default_dict = conf.dict_in_default
+    user_dict = conf.dict_in_user.get_dict()
+    user_config = json.loads(json.dumps(USER_CONFIG))
+    user_config["dict_in_both"]["nested_dict_in_both"]["key_in_both"] = "new_value"
+    with conf.user_config_path.open(mode="w") as file:
+        json.dump(user_config, file)
+    conf.reload()
+    assert nested.key_in_both == "new_value"
+    assert default_dict.key_d1 == DEFAULT_CONFIG["dict_in_default"]["key_d1"]
+    assert conf.dict_in_user.get_dict() is user_dict
+    assert conf.dict_in_both.nested_dict_in_both.get_dict() is nested.get_dict()
+
+
+def test_reload_reports_changes(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir)
+    _ = conf.dict_in_default
+    conf["string_in_user"] = "unsaved"
+    user_config = json.loads(json.dumps(USER_CONFIG))
+    del user_config["list_in_user"]
+    user_config["dict_in_both"]["key_in_user"] = "new_value"
+    user_config["dict_in_both"]["nested_dict_in_both"]["added"] = {"a": 1}
+    user_config["dict_in_default"] = {"key_d1": "new_value"}
+    user_config["string_in_default"] = "new_value"
+    with conf.user_config_path.open(mode="w") as file:
+        json.dump(user_config, file)
+    default_config = json.loads(json.dumps(DEFAULT_CONFIG))
+    del default_config["list_in_default"]
+    default_config["string_in_both"] = "new_value"
+    default_config["new_default"] = [1, 2]
+    with conf.default_config_path.open(mode="w") as file:
+        json.dump(default_config, file)
+
+    changes = conf.reload()
+    assert isinstance(changes, confjson.ChangeSet)
+    assert set(changes.added) == {
+        ("dict_in_both", "nested_dict_in_both", "added"),
+        ("new_default",),
+    }
+    assert set(changes.removed) == {("list_in_user",), ("list_in_default",)}
+    assert set(changes.modified) == {
+        ("string_in_user",),
+        ("dict_in_both", "key_in_user"),
+        ("dict_in_default", "key_d1"),
+        ("string_in_default",),
+    }
+    assert conf["string_in_user"] == USER_CONFIG["string_in_user"]
+    assert conf.dict_in_default.key_d1 == "new_value"
+    assert conf["string_in_default"] == "new_value"
+    assert "list_in_user" not in conf
+    assert "list_in_default" not in conf
+    assert conf["new_default"] == [1, 2]
+    assert not conf.reload()[0]
+
+
+def test_reload_removes_deleted_keys_from_loaded_dicts(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir)
+    proxy = conf.dict_in_user
+    conf.user_config_path.unlink()
+    changes = conf.reload()
+    assert ("dict_in_user",) in changes.removed
+    assert "dict_in_user" not in conf
+    assert proxy.key_u1 == USER_CONFIG["dict_in_user"]["key_u1"]
+
+
+def test_reload_sharded(tmpdir):
+    conf = confjson.Config(tmpdir, sharded=True)
+    conf["a"] = {"b": 1}
+    conf["c"] = 2
+    conf.save()
+    igur = confjson.Config(tmpdir, sharded=True)
+    proxy = igur.a
+    conf["a"]["b"] = 3
+    conf.save()
+    assert igur.reload() == ([], [], [("a", "b")])
+    assert proxy.b == 3
+    conf["c"] = 4
+    conf.save()
+    # Shards that were never read stay unread, so there is nothing to compare.
+    assert igur.reload() == ([], [], [])
+    assert "c" not in igur._user_dict  # pylint: disable=protected-access
+    assert igur["c"] == 4
+
+
+def test_reload_copies_only_changed_settings(tmpdir, monkeypatch):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir)
+    proxy = conf.dict_in_both
+    user_config = json.loads(json.dumps(USER_CONFIG))
+    user_config["dict_in_both"]["key_in_user"] = "new_value"
+    with conf.user_config_path.open(mode="w") as file:
+        json.dump(user_config, file)
+
+    def _fail(*_):
+        raise AssertionError("reload() copied the whole config")
+
+    monkeypatch.setattr(confjson, "_get_dict_union", _fail)
+    assert conf.reload().modified == [("dict_in_both", "key_in_user")]
+    assert proxy.key_in_user == "new_value"
+    # Settings handed out before the reload are still saved when changed.
+    proxy.key_in_user = "changed"
+    assert conf.is_modified()
+
+
+def _write_json(folder, filename, value):
+    with open(os.path.join(folder, filename), "w", encoding="utf-8") as file:
+        json.dump(value, file)
+
+
+def test_include_fragments_in_default_config(tmpdir):
+    os.mkdir(os.path.join(tmpdir, "services"))
+    _write_json(
+        tmpdir,
+        DEFAULT_CONFIG_FILENAME,
+        {
+            "db": {"$include": "services/db.json"},
+            "cache": {"$include": ["services/cache.json"], "size": 3},
+            "hosts": {"$include": "hosts.json"},
+        },
+    )
+    _write_json(tmpdir, "services/db.json", {"host": "db", "port": 5432})
+    _write_json(
+        tmpdir, "services/cache.json", {"size": 1, "ttl": {"$include": "ttl.json"}}
+    )
+    _write_json(tmpdir, "ttl.json", 60)
+    _write_json(tmpdir, "hosts.json", ["a", {"$include": "ttl.json"}])
+    conf = confjson.Config(tmpdir)
+    assert conf.db == {"host": "db", "port": 5432}
+    assert conf.cache == {"size": 3, "ttl": 60}
+    assert conf.hosts == ["a", 60]
+    conf.db.host = "other"
+    conf.save()
+    with conf.user_config_path.open() as file:
+        assert json.load(file) == {"db": {"host": "other"}}
+
+
+def test_include_written_with_escapes(tmpdir):
+    with open(
+        os.path.join(tmpdir, DEFAULT_CONFIG_FILENAME), "w", encoding="utf-8"
+    ) as file:
+        file.write('{"db": {"\\u0024include": "db.json"}}')
+    _write_json(tmpdir, "db.json", {"host": "db"})
+    assert confjson.Config(tmpdir).db == {"host": "db"}
+
+
+def test_include_cycle(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, {"a": {"$include": "a.json"}})
+    _write_json(tmpdir, "a.json", {"b": {"$include": "b.json"}})
+    _write_json(tmpdir, "b.json", {"$include": "a.json"})
+    with pytest.raises(ValueError):
+        _ = confjson.Config(tmpdir)
+
+
+def test_include_non_dict_with_siblings(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, {"a": {"$include": "a.json", "b": 1}})
+    _write_json(tmpdir, "a.json", [1, 2])
+    with pytest.raises(ValueError):
+        _ = confjson.Config(tmpdir)
+
+
+def test_include_missing_fragment(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, {"a": {"$include": "a.json"}})
+    with pytest.raises(FileNotFoundError):
+        _ = confjson.Config(tmpdir)
+
+
+def test_fragment_cache_reparses_only_changed_fragments(tmpdir):
+    _write_json(
+        tmpdir,
+        DEFAULT_CONFIG_FILENAME,
+        {"a": {"$include": "a.json"}, "b": {"$include": "b.json"}},
+    )
+    _write_json(tmpdir, "a.json", {"value": 1})
+    _write_json(tmpdir, "b.json", {"value": 2})
+    cache = confjson.FragmentCache()
+    conf = confjson.Config(tmpdir, fragment_cache=cache)
+    a_fragment = cache.load(conf.directory / "a.json")
+    b_fragment = cache.load(conf.directory / "b.json")
+    _write_json(tmpdir, "b.json", {"value": 22})
+    changes = conf.reload()
+    assert changes.modified == [("b", "value")]
+    assert cache.load(conf.directory / "a.json") is a_fragment
+    assert cache.load(conf.directory / "b.json") is not b_fragment
+
+
+def test_fragment_cache_shares_unchanged_default_config(tmpdir):
+    _generate_default_config(tmpdir)
+    cache = confjson.FragmentCache()
+    con = confjson.Config(tmpdir, fragment_cache=cache)
+    fig = confjson.Config(tmpdir, fragment_cache=cache)
+    assert con.get_path("dict_in_both") is fig.get_path("dict_in_both")
+    # Defaults handed out are copies, so that changes stay in one config.
+    con.get_default("dict_in_both")["key_in_both"] = "changed"
+    assert fig.get_default("dict_in_both") == DEFAULT_CONFIG["dict_in_both"]
+    assert fig.dict_in_both == DEFAULT_CONFIG["dict_in_both"]
+
+
+INTERPOLATED_CONFIG = {
+    "db": {"host": "db.example.com", "port": 5432},
+    "url": "postgres://${db.host}:${db.port}/app",
+    "port": "${db.port}",
+    "services": {"backup": {"url": "${url}/backup", "literal": "$${db.host}"}},
+}
+
+
+def test_interpolate_values(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, INTERPOLATED_CONFIG)
+    conf = confjson.Config(tmpdir, interpolate=True)
+    assert conf.url == "postgres://db.example.com:5432/app"
+    assert conf["port"] == 5432
+    assert conf.services.backup.url == "postgres://db.example.com:5432/app/backup"
+    assert conf.services.backup["literal"] == "${db.host}"
+    assert dict(conf.services.backup.items())["url"].endswith("/backup")
+    assert conf.get_path("url") == INTERPOLATED_CONFIG["url"]
+
+
+def test_interpolation_disabled_by_default(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, INTERPOLATED_CONFIG)
+    conf = confjson.Config(tmpdir)
+    assert conf.url == INTERPOLATED_CONFIG["url"]
+
+
+def test_interpolation_invalidated_when_reference_is_set(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, INTERPOLATED_CONFIG)
+    conf = confjson.Config(tmpdir, interpolate=True)
+    assert conf.services.backup.url.startswith("postgres://db.example.com")
+    conf.db.host = "other.example.com"
+    assert conf.url == "postgres://other.example.com:5432/app"
+    assert conf.services.backup.url.startswith("postgres://other.example.com")
+    conf["db"] = {"host": "third", "port": 1}
+    assert conf.url == "postgres://third:1/app"
+    conf.set_path("db.port", 2)
+    assert conf.port == 2
+    del conf["db"]
+    conf["db"] = {"host": "${name}", "port": 3}
+    conf["name"] = "fourth"
+    assert conf.services.backup.url == "postgres://fourth:3/app/backup"
+    conf.services.backup.url = "${db.port}"
+    assert conf.services.backup.url == 3
+
+
+def test_interpolation_saves_templates(tmpdir):
+    conf = confjson.Config(tmpdir, interpolate=True)
+    conf["host"] = "example.com"
+    conf["url"] = "https://${host}/"
+    assert conf.url == "https://example.com/"
+    conf.save()
+    with conf.user_config_path.open() as file:
+        assert json.load(file)["url"] == "https://${host}/"
+
+
+def test_interpolation_of_non_string_values(tmpdir):
+    conf = confjson.Config(tmpdir, interpolate=True)
+    conf["limits"] = {"max": [1, 2], "enabled": True}
+    conf["copy"] = "${limits.max}"
+    conf["text"] = "max=${limits.max} enabled=${limits.enabled}"
+    assert conf.copy == [1, 2]
+    assert conf.copy is conf.limits.max
+    assert conf.text == "max=[1, 2] enabled=true"
+
+
+def test_interpolation_of_dicts(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, INTERPOLATED_CONFIG)
+    conf = confjson.Config(tmpdir, interpolate=True)
+    conf["alias"] = "${services}"
+    conf["chained"] = "${alias}"
+    conf["text"] = "services: ${chained}"
+    assert conf.alias == conf.services
+    assert conf.alias.get_dict() is conf.services.get_dict()
+    assert conf.alias.backup.url == "postgres://db.example.com:5432/app/backup"
+    conf.alias.backup.url = "changed"
+    assert conf.services.backup.url == "changed"
+    assert conf.chained.backup.url == "changed"
+    assert conf.text.startswith('services: {"backup": ')
+    conf.save()
+    conf = confjson.Config(tmpdir, interpolate=True)
+    assert conf.services.backup.url == "changed"
+    assert conf.alias.backup["literal"] == "${db.host}"
+
+
+def test_interpolation_cycle(tmpdir):
+    conf = confjson.Config(tmpdir, interpolate=True)
+    conf["a"] = "${b.c}"
+    conf["b"] = {"c": "x${a}"}
+    with pytest.raises(ValueError):
+        _ = conf.a
+
+
+def test_interpolation_of_missing_reference(tmpdir):
+    conf = confjson.Config(tmpdir, interpolate=True, use_placeholders=True)
+    conf["a"] = "${does.not.exist}"
+    with pytest.raises(ValueError):
+        _ = conf.a
+    assert conf.b.c.is_placeholder
+
+
+class _Counter:  # pylint: disable=too-few-public-methods
+    def __init__(self, function):
+        self.function = function
+        self.calls = 0
+
+    def __call__(self, conf):
+        self.calls += 1
+        return self.function(conf)
+
+
+def test_computed_is_cached(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, INTERPOLATED_CONFIG)
+    conf = confjson.Config(tmpdir)
+    dsn = _Counter(lambda conf: f"{conf.db.host}:{conf.db.port}")
+    conf.computed("db.dsn", dsn)
+    assert conf.get_computed("db.dsn") == "db.example.com:5432"
+    assert conf.get_computed("db.dsn") == "db.example.com:5432"
+    assert dsn.calls == 1
+    conf["name"] = "unrelated"
+    conf.services.backup.literal = "unrelated"
+    assert conf.get_computed("db.dsn") == "db.example.com:5432"
+    assert dsn.calls == 1
+
+
+def test_computed_recomputed_when_dependency_is_set(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, INTERPOLATED_CONFIG)
+    conf = confjson.Config(tmpdir)
+
+    @conf.computed("db.dsn")
+    @_Counter
+    def dsn(conf):
+        return f"{conf.db.host}:{conf['db']['port']}"
+
+    assert conf.get_computed("db.dsn") == "db.example.com:5432"
+    conf.db.host = "other"
+    assert conf.get_computed("db.dsn") == "other:5432"
+    conf["db"] = {"host": "third", "port": 1}
+    assert conf.get_computed("db.dsn") == "third:1"
+    conf.set_path("db.port", 2)
+    assert conf.get_computed("db.dsn") == "third:2"
+    assert dsn.calls == 4
+
+
+def test_computed_depends_on_missing_keys_and_other_computed(tmpdir):
+    conf = confjson.Config(tmpdir, use_placeholders=True)
+    conf.computed("debug", lambda conf: bool(conf.get("debug")))
+    conf.computed("verbose", lambda conf: conf.get_computed("debug") or "log" in conf)
+    conf.computed("level", lambda conf: "high" if conf.flags.level.enabled else "low")
+    conf.computed("count", len)
+    assert conf.get_computed("verbose") is False
+    assert conf.get_computed("level") == "low"
+    assert conf.get_computed("count") == 0
+    conf["debug"] = True
+    assert conf.get_computed("verbose") is True
+    conf.flags.level.enabled = True
+    assert conf.get_computed("level") == "high"
+    assert conf.get_computed("count") == 2
+
+
+def test_computed_recomputed_after_load(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, INTERPOLATED_CONFIG)
+    conf = confjson.Config(tmpdir)
+    host = _Counter(lambda conf: conf.db.get_dict()["host"])
+    name = _Counter(lambda conf: conf.get("url"))
+    conf.computed("host", host)
+    conf.computed("url", name)
+    conf.get_computed("host")
+    conf.get_computed("url")
+    other = confjson.Config(tmpdir)
+    other.db.host = "other"
+    other.save()
+    conf.load()
+    assert conf.get_computed("host") == "other"
+    assert conf.get_computed("url") == INTERPOLATED_CONFIG["url"]
+    assert host.calls == 2
+    assert name.calls == 1
+    other.db.host = "third"
+    other.save()
+    assert conf.reload().modified == [("db", "host")]
+    assert conf.get_computed("host") == "third"
+
+
+def test_computed_follows_interpolation(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, INTERPOLATED_CONFIG)
+    conf = confjson.Config(tmpdir, interpolate=True)
+    conf.computed("backup", lambda conf: conf.services.backup.url.upper())
+    assert conf.get_computed("backup").startswith("POSTGRES://DB.EXAMPLE.COM")
+    conf.db.host = "other"
+    assert conf.get_computed("backup").startswith("POSTGRES://OTHER")
+    conf.computed("port", lambda conf: conf.port)
+    assert conf.get_computed("port") == 5432
+    other = confjson.Config(tmpdir)
+    other.db.port = 1
+    other.save()
+    conf.load()
+    assert conf.get_computed("port") == 1
+
+
+def test_computed_cycle(tmpdir):
+    conf = confjson.Config(tmpdir)
+    conf.computed("a", lambda conf: conf.get_computed("b"))
+    conf.computed("b", lambda conf: conf.get_computed("a"))
+    with pytest.raises(ValueError):
+        conf.get_computed("a")
+    with pytest.raises(KeyError):
+        conf.get_computed("c")
+
+
+COMPACT_CONFIG = {
+    "ints": list(range(1000, 1020)),
+    "floats": [i / 2 for i in range(20)],
+    "short": [1, 2, 3],
+    "mixed": [1, 2.5] * 10,
+    "huge": [2 ** 70] * 10,
+    "hosts": [{"role": "primary", "zone": "eu"}, {"role": "replica", "zone": "eu"}],
+}
+
+
+def test_memory_optimized_interns_keys_and_short_strings(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, COMPACT_CONFIG)
+    _write_json(tmpdir, USER_CONFIG_FILENAME, {"hosts": COMPACT_CONFIG["hosts"]})
+    conf = confjson.Config(tmpdir, memory_optimized=True)
+    first, second = conf.hosts
+    assert first["zone"] is second["zone"]
+    default_first = conf.get_default("hosts")[0]
+    assert default_first["role"] is first["role"]
+    assert next(iter(default_first)) is next(iter(first.keys()))
+    stats = conf.memory_stats()
+    assert stats["strings"] > stats["unique_strings"]
+    assert stats["interned_string_bytes_saved"] > 0
+    plain_stats = confjson.Config(tmpdir).memory_stats()
+    assert plain_stats["strings"] == stats["strings"]
+    assert plain_stats["shared_string_bytes"] < stats["shared_string_bytes"]
+    assert plain_stats["interned_string_bytes_saved"] == 0
+    assert plain_stats["compact_list_bytes_saved"] == 0
+
+
+def test_compact_lists(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, COMPACT_CONFIG)
+    conf = confjson.Config(tmpdir, memory_optimized=True)
+    plain = confjson.Config(tmpdir)
+    stats = conf.memory_stats()
+    assert stats["compact_lists"] == 2
+    assert stats["compact_items"] == 40
+    assert stats["compact_list_bytes_saved"] > 0
+    for key, value in COMPACT_CONFIG.items():
+        assert conf[key] == value
+        assert value == conf[key]
+    assert not isinstance(conf.ints, list)
+    assert isinstance(conf.short, list)
+    assert isinstance(conf.mixed, list)
+    assert isinstance(conf.huge, list)
+    assert conf.ints[1:3] == [1001, 1002]
+    assert conf.ints + [1] == COMPACT_CONFIG["ints"] + [1]
+    assert [1] + conf.ints == [1] + COMPACT_CONFIG["ints"]
+    assert repr(conf.floats) == repr(COMPACT_CONFIG["floats"])
+    assert conf.ints != "ints"
+    # pylint: disable=protected-access
+    assert confjson._values_equal(conf.get_default("ints"), plain.get_default("ints"))
+
+
+def test_compact_list_mutation(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, COMPACT_CONFIG)
+    conf = confjson.Config(tmpdir, memory_optimized=True)
+    ints = conf.ints
+    expected = list(COMPACT_CONFIG["ints"])
+    before = conf.get_default("ints").fingerprint()
+    ints.append(5)
+    ints[0] = 7
+    ints[1:3] = iter([8, 9])
+    del ints[3]
+    ints.insert(0, 6)
+    ints.sort(reverse=True)
+    expected.append(5)
+    expected[0] = 7
+    expected[1:3] = [8, 9]
+    del expected[3]
+    expected.insert(0, 6)
+    expected.sort(reverse=True)
+    assert ints == expected
+    ints += [2 ** 70]
+    ints.append("text")
+    ints.insert(0, {"a": 1})
+    ints[1] = 1.5
+    ints[2:3] = iter(["a", "b"])
+    expected += [2 ** 70, "text"]
+    expected.insert(0, {"a": 1})
+    expected[1] = 1.5
+    expected[2:3] = ["a", "b"]
+    assert ints == expected
+    assert conf.get_default("ints").fingerprint() == before
+    conf.save()
+    assert confjson.Config(tmpdir)["ints"] == expected
+    ints.clear()
+    assert not ints
+
+
+def test_compact_list_fingerprint_invalidation(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, {"a": COMPACT_CONFIG})
+    conf = confjson.Config(tmpdir, memory_optimized=True)
+    before = conf.a.fingerprint()
+    conf.a.floats[0] = 10.5
+    assert conf.a.fingerprint() != before
+    conf.a.floats[0] = 0.0
+    assert conf.a.fingerprint() == before
+    conf.a.floats.append("x")
+    after = conf.a.fingerprint()
+    conf.a.floats[-1] = "y"
+    assert conf.a.fingerprint() != after
+
+
+def test_compact_list_can_be_pickled(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, COMPACT_CONFIG)
+    conf = confjson.Config(tmpdir, memory_optimized=True)
+    ints = conf.ints
+    assert pickle.loads(pickle.dumps(ints)) == COMPACT_CONFIG["ints"]
+    assert copy.copy(ints) == COMPACT_CONFIG["ints"]
+    ints.append("text")
+    assert pickle.loads(pickle.dumps(ints)) == COMPACT_CONFIG["ints"] + ["text"]
+
+
+def test_compact_list_fallback_fingerprint(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, COMPACT_CONFIG)
+    conf = confjson.Config(tmpdir, memory_optimized=True)
+    ints = conf.ints
+    ints.insert(0, {"a": 1})
+    conf.save()
+    before = ints.fingerprint()
+    ints[0]["a"] = 2
+    assert ints.fingerprint() != before
+    assert conf.is_modified()
+    conf.save()
+    assert confjson.Config(tmpdir)["ints"][0] == {"a": 2}
+
+
+def test_memory_optimized_journal_and_shards(tmpdir):
+    conf = confjson.Config(tmpdir, memory_optimized=True, sharded=True)
+    conf["ints"] = COMPACT_CONFIG["ints"]
+    conf.save()
+    reloaded = confjson.Config(tmpdir, memory_optimized=True, sharded=True)
+    assert not isinstance(reloaded.ints, list)
+    reloaded["copy"] = reloaded.ints
+    reloaded.save()
+    assert confjson.Config(tmpdir, sharded=True).copy == COMPACT_CONFIG["ints"]
+    journal_dir = os.path.join(tmpdir, "journal")
+    os.mkdir(journal_dir)
+    conf = confjson.Config(journal_dir, memory_optimized=True, journal=True)
+    conf["ints"] = reloaded.ints
+    conf.save()
+    assert confjson.Config(journal_dir, journal=True).ints == COMPACT_CONFIG["ints"]
+
+
+def test_to_json_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        confjson._to_json(object())  # pylint: disable=protected-access
+
+
+def test_diff(tmpdir):
+    _generate_both_config_files(tmpdir)
+    conf = confjson.Config(tmpdir, sharded=True)
+    conf.save()
+    conf = confjson.Config(tmpdir, sharded=True)
+    conf.dict_in_default.key_d1 = "changed"
+    diff = conf.diff()
+    assert diff["dict_in_default"] == {"key_d1": "changed"}
+    assert diff["string_in_user"] == USER_CONFIG["string_in_user"]
+    assert "string_in_default" not in diff
+    assert conf.diff("dict_in_default.key_d1") == "changed"
+    assert conf.diff(["dict_in_default"]) == {"key_d1": "changed"}
+    conf.diff()["dict_in_default"]["key_d1"] = "not in the config"
+    assert conf.dict_in_default.key_d1 == "changed"
+    with pytest.raises(KeyError):
+        conf.diff("dict_in_default.key_d2")
+    with pytest.raises(KeyError):
+        conf.diff("string_in_user.key")
+
+
+def test_is_modified(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, DEFAULT_CONFIG)
+    _write_json(tmpdir, USER_CONFIG_FILENAME, USER_CONFIG)
+    conf = confjson.Config(tmpdir)
+    assert not conf.is_modified()
+    for key in conf.keys():
+        conf.get(key)
+    assert not conf.is_modified()
+    conf.dict_in_default.key_d1 = "changed"
+    assert conf.is_modified()
+    conf.dict_in_default.key_d1 = DEFAULT_CONFIG["dict_in_default"]["key_d1"]
+    assert not conf.is_modified()
+    conf.list_in_both.append("new")
+    assert conf.is_modified()
+    conf.save()
+    assert not conf.is_modified()
+    del conf["string_in_user"]
+    assert conf.is_modified()
+    conf.load()
+    assert not conf.is_modified()
+
+
+@pytest.mark.parametrize("kwargs", [{"sharded": True}, {"journal": True}])
+def test_is_modified_storage_modes(tmpdir, kwargs):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, DEFAULT_CONFIG)
+    conf = confjson.Config(tmpdir, **kwargs)
+    conf["a"] = {"b": 1}
+    conf["c"] = 2
+    assert conf.is_modified()
+    conf.save()
+    assert not conf.is_modified()
+    conf = confjson.Config(tmpdir, **kwargs)
+    assert conf.a.b == 1
+    assert not conf.is_modified()
+    conf.a.b = 3
+    assert conf.is_modified()
+    conf.reload()
+    assert not conf.is_modified()
+
+
+def test_is_modified_fingerprints_only_settings_handed_out(tmpdir):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, DEFAULT_CONFIG)
+    _write_json(tmpdir, USER_CONFIG_FILENAME, USER_CONFIG)
+    conf = confjson.Config(tmpdir)
+    # pylint: disable=protected-access
+    user_dict = conf._user_dict
+    assert all(
+        value._fingerprint is None
+        for value in user_dict.values()
+        if isinstance(value, (dict, list))
+    )
+    assert conf.get_path("dict_in_default.key_d1")
+    conf.save()
+    assert not conf.is_modified()
+    conf.list_in_both.append("new")
+    assert conf.is_modified()
+    assert user_dict["dict_in_default"]._fingerprint is None
+    conf.save()
+    assert user_dict["dict_in_default"]._fingerprint is None
+    conf.list_in_both.pop()
+    assert conf.is_modified()
+
+
+def _write_tenant(folder, name, default_config, user_config=None):
+    os.mkdir(os.path.join(folder, name))
+    _write_json(os.path.join(folder, name), DEFAULT_CONFIG_FILENAME, default_config)
+    if user_config is not None:
+        _write_json(os.path.join(folder, name), USER_CONFIG_FILENAME, user_config)
+
+
+def test_config_set(tmpdir):
+    for name in ("b", "a", "c"):
+        _write_tenant(tmpdir, name, DEFAULT_CONFIG, {"tenant": name})
+    _write_json(tmpdir, "not_a_tenant.json", {})
+    configs = confjson.ConfigSet(tmpdir, use_placeholders=True)
+    assert list(configs) == ["a", "b", "c"]
+    assert len(configs) == 3
+    assert "a" in configs
+    assert "not_a_tenant.json" not in configs
+    assert not configs.loaded()
+    assert configs["b"].tenant == "b"
+    assert configs["b"].missing.is_placeholder
+    assert configs.loaded() == ["b"]
+    assert configs["b"] is configs["b"]
+    assert configs.get("missing") is None
+    with pytest.raises(KeyError):
+        configs["missing"]  # pylint: disable=pointless-statement
+    # Identical default files are parsed once and shared.
+    # pylint: disable=protected-access
+    assert configs["a"]._default_dict is configs["b"]._default_dict
+
+
+def test_config_set_loads_without_holding_lock(tmpdir, monkeypatch):
+    _write_tenant(tmpdir, "a", {})
+    _write_tenant(tmpdir, "b", {})
+    configs = confjson.ConfigSet(tmpdir)
+    loaded = configs["a"]
+    started = threading.Event()
+    release = threading.Event()
+    # pylint: disable=protected-access
+    create_config = configs._create_config
+
+    def _slow_create_config(name):
+        started.set()
+        release.wait(5)
+        return create_config(name)
+
+    monkeypatch.setattr(configs, "_create_config", _slow_create_config)
+    thread = threading.Thread(target=configs.__getitem__, args=("b",))
+    thread.start()
+    try:
+        assert started.wait(5)
+        assert configs._lock.acquire(timeout=1)
+        configs._lock.release()
+        assert configs["a"] is loaded
+    finally:
+        release.set()
+        thread.join()
+    assert configs.loaded() == ["a", "b"]
+
+
+def test_config_set_load_and_evict(tmpdir):
+    for index in range(6):
+        _write_tenant(tmpdir, f"tenant{index}", {"index": index})
+    configs = confjson.ConfigSet(tmpdir, max_loaded=3, max_workers=2)
+    configs.load()
+    assert configs.loaded() == ["tenant0", "tenant1", "tenant2"]
+    assert configs["tenant1"].index == 1
+    configs["tenant0"]["index"] = 10
+    configs["tenant3"]  # pylint: disable=pointless-statement
+    assert configs.loaded() == ["tenant1", "tenant0", "tenant3"]
+    configs.load(["tenant4", "tenant5"])
+    assert configs.loaded() == ["tenant0", "tenant4", "tenant5"]
+    assert configs["tenant0"].index == 10
+    with pytest.raises(KeyError):
+        configs.load(["missing"])
+
+
+def test_config_set_save_all(tmpdir):
+    for name in ("a", "b", "c"):
+        _write_tenant(tmpdir, name, {"value": 0})
+    configs = confjson.ConfigSet(tmpdir, max_loaded=1)
+    configs["a"]["value"] = 1
+    configs["b"]["value"] = 2
+    configs["c"]  # pylint: disable=pointless-statement
+    assert configs.loaded() == ["a", "b", "c"]
+    assert configs.save_all() == ["a", "b"]
+    assert configs.loaded() == ["c"]
+    assert configs.save_all() == []
+    assert not os.path.exists(os.path.join(tmpdir, "c", USER_CONFIG_FILENAME))
+    assert confjson.Config(os.path.join(tmpdir, "b")).value == 2
+
+
+def test_config_set_rescan(tmpdir):
+    _write_tenant(tmpdir, "a", {})
+    _write_tenant(tmpdir, "b", {})
+    configs = confjson.ConfigSet(tmpdir)
+    configs.load()
+    _write_tenant(tmpdir, "c", {})
+    os.remove(os.path.join(tmpdir, "a", DEFAULT_CONFIG_FILENAME))
+    os.rmdir(os.path.join(tmpdir, "a"))
+    configs.rescan()
+    assert list(configs) == ["b", "c"]
+    assert configs.loaded() == ["b"]
+    with pytest.raises(ValueError):
+        confjson.ConfigSet(os.path.join(tmpdir, "missing"))
+
+
+def test_fragment_cache_shares_identical_files(tmpdir):
+    cache = confjson.FragmentCache()
+    for name in ("a", "b"):
+        _write_json(tmpdir, name, {"key": [1, 2]})
+    first = cache.load(pathlib.Path(tmpdir, "a"))
+    assert cache.load(pathlib.Path(tmpdir, "b")) is first
+    assert cache.load(pathlib.Path(tmpdir, "b"), memory_optimized=True) is not first
+    _write_json(tmpdir, "a", {"key": [1, 2, 3]})
+    os.utime(os.path.join(tmpdir, "a"), ns=(0, 0))
+    assert cache.load(pathlib.Path(tmpdir, "a"))[0] == {"key": [1, 2, 3]}
+    assert cache.load(pathlib.Path(tmpdir, "b")) is first
+
+
+def _write_gzip_json(folder, filename, value):
+    with gzip.open(os.path.join(folder, filename), "wt") as file:
+        json.dump(value, file)
+
+
+def test_compressed_default_config(tmpdir):
+    _write_gzip_json(tmpdir, DEFAULT_CONFIG_FILENAME + ".gz", DEFAULT_CONFIG)
+    _write_json(tmpdir, USER_CONFIG_FILENAME, USER_CONFIG)
+    conf = confjson.Config(tmpdir)
+    assert conf.string_in_default == DEFAULT_CONFIG["string_in_default"]
+    assert conf.string_in_both == USER_CONFIG["string_in_both"]
+    # The uncompressed file takes priority.
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, {"plain": True})
+    conf.load()
+    assert conf.plain
+
+
+def test_compressed_default_config_filename(tmpdir):
+    _write_gzip_json(tmpdir, "defaults.json.gz", {"routes": {"$include": "r.json.gz"}})
+    _write_gzip_json(tmpdir, "r.json.gz", {"a": 1})
+    conf = confjson.Config(tmpdir, default_config_filename="defaults.json.gz")
+    assert conf.routes.a == 1
+
+
+@pytest.mark.parametrize("compression_level", [None, 1])
+def test_compressed_user_config(tmpdir, compression_level):
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME, DEFAULT_CONFIG)
+    conf = confjson.Config(
+        tmpdir,
+        user_config_filename="user.config.json.gz",
+        compression_level=compression_level,
+    )
+    conf.string_in_default = "changed"
+    conf.save()
+    with gzip.open(os.path.join(tmpdir, "user.config.json.gz"), "rt") as file:
+        assert json.load(file) == {"string_in_default": "changed"}
+    conf = confjson.Config(tmpdir, user_config_filename="user.config.json.gz")
+    assert conf.string_in_default == "changed"
+
+
+def test_compressed_user_config_journal(tmpdir):
+    conf = confjson.Config(
+        tmpdir, user_config_filename="user.config.json.gz", journal=True
+    )
+    conf["a"] = 1
+    conf.save()
+    conf.compact()
+    with gzip.open(os.path.join(tmpdir, "user.config.json.gz"), "rt") as file:
+        assert json.load(file) == {"a": 1}
+    conf = confjson.Config(
+        tmpdir, user_config_filename="user.config.json.gz", journal=True
+    )
+    assert conf.a == 1
+
+
+def test_zstandard_config(tmpdir):
+    zstandard = pytest.importorskip("zstandard")
+    with open(os.path.join(tmpdir, DEFAULT_CONFIG_FILENAME + ".zst"), "wb") as file:
+        file.write(zstandard.ZstdCompressor().compress(b'{"a": 1}'))
+    conf = confjson.Config(tmpdir, user_config_filename="user.config.json.zst")
+    assert conf.a == 1
+    conf.a = 2
+    conf.save()
+    conf = confjson.Config(tmpdir, user_config_filename="user.config.json.zst")
+    assert conf.a == 2
+
+
+def test_zstandard_missing(tmpdir, monkeypatch):
+    monkeypatch.setattr(confjson, "zstandard", None)
+    _write_json(tmpdir, DEFAULT_CONFIG_FILENAME + ".zst", {})
+    with pytest.raises(ValueError):
+        confjson.Config(tmpdir)